@@ -1,8 +1,7 @@
-import sys
-import json5
 import click
 
 from rgai_tools.common import model_loader
+from rgai_tools.common import record_reader
 from rgai_tools.agile_classifier import model_wrapper
 
 _DEFAULT_MODEL_PRESET = "gemma_instruct_2b_en"
@@ -44,6 +43,22 @@ def agile_classifier():
     default=128,
     help="Maximum sequence length for the model's preprocessor.",
 )
+@click.option(
+    "--input-file",
+    type=click.Path(exists=True, dir_okay=False),
+    help="JSON(L), CSV or Parquet file to read from instead of stdin.",
+)
+@click.option(
+    "--num-workers",
+    type=click.INT,
+    default=0,
+    help="Number of worker processes used to parse JSONL input.",
+)
+@click.option(
+    "--sequence-packing/--no-sequence-packing",
+    default=False,
+    help="Pack several examples into each training sequence.",
+)
 def train(
     *,
     labels: str,
@@ -51,6 +66,9 @@ def train(
     model_preset: str,
     epochs: int,
     max_sequence_length: int,
+    input_file: str | None,
+    sequence_packing: bool,
+    num_workers: int,
 ):
   # The model output path should end with ".lora.h5".
   if not model_output.endswith(".lora.h5"):
@@ -62,19 +80,23 @@ def train(
       max_sequence_length=max_sequence_length,
   )
 
-  # Read the data from stdin.
-  records = []
-  for line in sys.stdin.readlines():
-    line = line.strip()
-    if line:
-      try:
-        record = json5.loads(line)
-        records.append({"text": record["text"], "label": record["label"]})
-      except Exception as exc:
-        click.echo(f"Failed to parse input line: {line}", err=True)
-        click.echo("Expected format:", err=True)
-        click.echo('{"text": "text content", "label": "label"}', err=True)
-        raise exc
+  # Read the data from stdin, or the given input file.
+  def report_error(error: record_reader.RecordError) -> None:
+    click.echo(
+        f"Skipping input line {error.line_number}: {error.content}. "
+        f"Error: {error.error}. Expected format: "
+        '{"text": "text content", "label": "label"}',
+        err=True,
+    )
+
+  records = list(
+      record_reader.read_records(
+          input_file,
+          required_fields=("text", "label"),
+          num_workers=num_workers,
+          on_error=report_error,
+      )
+  )
 
   # Train the classifier.
   classifier = model_wrapper.train_agile_classifier(
@@ -83,6 +105,7 @@ def train(
       x_train=[x["text"] for x in records],
       y_train=[x["label"] for x in records],
       epochs=epochs,
+      sequence_packing=sequence_packing,
   )
 
   # Save the model (only the LoRA weights).
@@ -96,5 +119,63 @@ def train(
   )
 
 
+@agile_classifier.command()
+@click.option(
+    "--labels",
+    type=click.STRING,
+    required=True,
+    help="Comma-separated list of labels for the classifier.",
+)
+@click.option(
+    "--model-preset",
+    type=click.STRING,
+    default=_DEFAULT_MODEL_PRESET,
+    help="Preset (name) of the model, or path to local keras model.",
+)
+@click.option(
+    "--lora-weights",
+    type=click.Path(exists=True, dir_okay=False),
+    required=True,
+    help="Path to the LoRA weights saved by `train`.",
+)
+@click.option(
+    "--max-sequence-length",
+    type=click.INT,
+    default=128,
+    help="Maximum sequence length for the model's preprocessor.",
+)
+@click.option(
+    "--output-dir",
+    type=click.Path(exists=False),
+    required=True,
+    help="Directory to write the exported SavedModel to.",
+)
+def export(
+    *,
+    labels: str,
+    model_preset: str,
+    lora_weights: str,
+    max_sequence_length: int,
+    output_dir: str,
+):
+  # Load the LLM model and its LoRA weights.
+  llm = model_loader.load_gemma_model(
+      preset=model_preset,
+      max_sequence_length=max_sequence_length,
+      stream_weights=True,
+  )
+  llm.backbone.load_lora_weights(lora_weights)
+
+  # Export the classifier, merging the LoRA weights into the base model.
+  labels = labels.split(",")
+  classifier = model_wrapper.AgileClassifier(model=llm, labels=labels)
+  classifier.export(output_dir)
+  click.echo(
+      f"The exported model can be loaded using the following code:\n"
+      f"classifier = model_wrapper.AgileClassifier(\n"
+      f"    model=None, labels={labels}, exported_model_path='{output_dir}')"
+  )
+
+
 if __name__ == "__main__":
   agile_classifier()
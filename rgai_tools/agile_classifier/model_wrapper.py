@@ -1,13 +1,18 @@
-from typing import Iterable
+from typing import Iterable, TYPE_CHECKING
 
 import keras
-import keras_nlp
 import numpy
 import tensorflow as tf
 
 from rgai_tools.agile_classifier import text_processing
+from rgai_tools.common import export
+from rgai_tools.common import scoring
+from rgai_tools.common import sequence_packing as sequence_packing_lib
 from rgai_tools.common import token_probability
 
+if TYPE_CHECKING:
+  import keras_nlp
+
 
 _DEFAULT_PROMPT = "Classify the following text into one of the following classes"
 
@@ -17,21 +22,46 @@ class AgileClassifier:
 
   def __init__(
       self,
-      model: keras_nlp.models.CausalLM,
+      model: "keras_nlp.models.CausalLM | None",
       labels: tuple[str, ...],
       instructions: str = _DEFAULT_PROMPT,
       separator_token: str = "<separator>",
       end_of_text_token: str = "<eos>",
+      jit_compile: bool = True,
+      warmup: bool = False,
+      exported_model_path: str | None = None,
   ):
+    if (model is None) == (exported_model_path is None):
+      raise ValueError("Either model or exported_model_path must be provided")
+
     self.model = model
     self.labels = labels
     self.instructions = instructions
     self.separator_token = separator_token
     self.end_of_text_token = end_of_text_token
+    if exported_model_path:
+      # Exported models bundle the tokenizer and are already compiled.
+      self.probability_model = None
+      self.scoring_fn = export.ExportedScoringModel(exported_model_path)
+      exported_labels = self.scoring_fn.metadata.get("token_set")
+      if list(labels) != exported_labels:
+        raise ValueError(
+            f"Labels {labels} do not match the exported labels "
+            f"{exported_labels}."
+        )
+      return
+
     self.probability_model = token_probability.build_token_probability_model(
         model=model,
         token_set=labels,
     )
+    self.scoring_fn = scoring.ScoringFunction(
+        self.probability_model,
+        max_sequence_length=model.preprocessor.sequence_length,
+        jit_compile=jit_compile,
+    )
+    if warmup:
+      self.scoring_fn.warmup()
 
   def _encode_for_prediction(self, x_text: str) -> str:
     return text_processing.build_prompt(
@@ -49,31 +79,78 @@ class AgileClassifier:
       x_train: list[str],
       y_train: list[str],
       batch_size: int = 1,
+      sequence_packing: bool = False,
       **fit_opts,
   ) -> keras.callbacks.History:
+    """Fine-tunes the model on the given examples.
+
+    With `sequence_packing`, several examples are concatenated into each row
+    of `max_sequence_length` tokens instead of padding every example to its
+    own row, and `batch_size` counts rows rather than examples. Attention and
+    loss never cross from one example to another.
+    """
+    if self.model is None:
+      raise ValueError("Cannot train a model loaded from an export")
     records = list(map(self._encode_for_training, x_train, y_train))
-    ds_train = tf.data.Dataset.from_tensor_slices(records).batch(batch_size)
-    return self.model.fit(ds_train, **fit_opts)
+    if not sequence_packing:
+      ds_train = tf.data.Dataset.from_tensor_slices(records).batch(batch_size)
+      return self.model.fit(ds_train, **fit_opts)
+
+    preprocessor = self.model.preprocessor
+    token_ids, segment_ids = sequence_packing_lib.pack(
+        sequence_packing_lib.tokenize(preprocessor, records),
+        length=preprocessor.sequence_length + 1,
+        pad_token_id=preprocessor.tokenizer.pad_token_id,
+    )
+    ds_train = tf.data.Dataset.from_tensor_slices(
+        sequence_packing_lib.to_training_data(token_ids, segment_ids)
+    ).batch(batch_size)
+
+    # The packed model shares the weights of the original model, and is
+    # trained with the same loss, metrics and optimizer instance, so that the
+    # optimizer state carries over between calls to `fit`.
+    compile_config = self.model.get_compile_config()
+    if compile_config is None:
+      raise ValueError("The model must be compiled before calling `fit`")
+    compile_config = keras.saving.deserialize_keras_object(compile_config)
+    compile_config["optimizer"] = self.model.optimizer
+    packed_model = sequence_packing_lib.PackedGemmaCausalLM(self.model.backbone)
+    packed_model.compile(**compile_config)
+    return packed_model.fit(ds_train, **fit_opts)
 
   def predict_score(self, x_text: Iterable[str]) -> list[tuple[float, float]]:
     """Predicts the probabilities for the label tokens."""
     prompts = [self._encode_for_prediction(text) for text in x_text]
+    if self.model is None:
+      return self.scoring_fn(prompts)
     inputs = self.model.preprocessor.generate_preprocess(prompts)
-    return self.probability_model.predict(inputs, verbose=0)
+    return self.scoring_fn(inputs)
 
   def predict(self, x_text: Iterable[str]) -> list[str]:
     idx = numpy.argmax(self.predict_score(x_text), axis=1)
     return [self.labels[i] for i in idx]
 
+  def export(self, path: str) -> None:
+    """Exports the scoring model, with merged LoRA weights, as a SavedModel."""
+    if self.model is None:
+      raise ValueError("Cannot export a model loaded from an export")
+    export.export_scoring_model(
+        self.model,
+        self.probability_model,
+        path,
+        metadata={"token_set": list(self.labels)},
+    )
+
 
 def train_agile_classifier(
     labels: tuple[str, ...],
-    model: keras_nlp.models.CausalLM,
+    model: "keras_nlp.models.CausalLM",
     x_train: list[str],
     y_train: list[str],
     epochs: int = 1,
     batch_size: int = 1,
     lora_rank: int = 4,
+    sequence_packing: bool = False,
 ) -> AgileClassifier:
   # Create an instance of the AgileClassifier.
   agile_classifier = AgileClassifier(model=model, labels=labels)
@@ -94,6 +171,7 @@ def train_agile_classifier(
       y_train,
       epochs=epochs,
       batch_size=batch_size,
+      sequence_packing=sequence_packing,
   )
 
   # Return the trained AgileClassifier.
@@ -0,0 +1,118 @@
+import contextlib
+import json
+import os
+from typing import Any, Iterable, Iterator, TYPE_CHECKING
+
+import keras
+import numpy
+import tensorflow as tf
+
+if TYPE_CHECKING:
+  import keras_nlp
+
+_METADATA_FILE = "rgai_tools.json"
+_ENDPOINT_NAME = "serve"
+
+
+@contextlib.contextmanager
+def merged_lora_weights(model: "keras_nlp.models.CausalLM") -> Iterator[None]:
+  """Folds LoRA updates into the base kernels of a model within the context.
+
+  The LoRA kernels are zeroed meanwhile, so the model computes the same
+  function but its weights no longer depend on the LoRA factors. The original
+  weights are restored on exit, so training can carry on afterwards.
+  """
+  layers = [
+      layer
+      for layer in model.backbone._flatten_layers(include_self=False)
+      if getattr(layer, "lora_enabled", False)
+  ]
+  originals = [
+      (layer._kernel.numpy(), layer.lora_kernel_b.numpy()) for layer in layers
+  ]
+  try:
+    for layer in layers:
+      merged_kernel = layer.kernel
+      layer._kernel.assign(merged_kernel)
+      layer.lora_kernel_b.assign(tf.zeros_like(layer.lora_kernel_b))
+    yield
+  finally:
+    for layer, (kernel, lora_kernel_b) in zip(layers, originals):
+      layer._kernel.assign(kernel)
+      layer.lora_kernel_b.assign(lora_kernel_b)
+
+
+def export_scoring_model(
+    model: "keras_nlp.models.CausalLM",
+    probability_model: "keras.Model",
+    path: str,
+    metadata: dict[str, Any] | None = None,
+) -> None:
+  """Exports a token probability model as a SavedModel taking raw prompts.
+
+  The exported `serving_default` signature takes a 1D string tensor of prompts
+  and runs tokenization, padding and scoring inside the graph, so it can be
+  loaded with `ExportedScoringModel` without keras_nlp.
+
+  Args:
+    model: The causal LM, whose preprocessor is bundled with the export.
+    probability_model: The token probability model built around `model`.
+    path: The directory to write the SavedModel to.
+    metadata: Optional JSON-serializable metadata stored with the export.
+  """
+  if keras.backend.backend() != "tensorflow":
+    raise ValueError(
+        "Exporting requires the TensorFlow backend, but Keras is using "
+        f"{keras.backend.backend()}. Set KERAS_BACKEND=tensorflow."
+    )
+  preprocessor = model.preprocessor
+
+  # Attaching the preprocessor to the module also tracks the tokenizer
+  # resources, which `keras.export.ExportArchive` would leave out.
+  module = tf.Module()
+  module.preprocessor = preprocessor
+  module.probability_model = probability_model
+
+  @tf.function(input_signature=[tf.TensorSpec(shape=[None], dtype=tf.string)])
+  def serve(prompts):
+    inputs = preprocessor.generate_preprocess(prompts)
+    return probability_model(inputs, training=False)
+
+  setattr(module, _ENDPOINT_NAME, serve)
+  with merged_lora_weights(model):
+    tf.saved_model.save(module, path, signatures={"serving_default": serve})
+
+  metadata = dict(metadata or {})
+  metadata["sequence_length"] = preprocessor.sequence_length
+  with open(os.path.join(path, _METADATA_FILE), "w") as f:
+    json.dump(metadata, f)
+
+
+class ExportedScoringModel:
+  """Scoring model loaded from a SavedModel written by `export_scoring_model`.
+
+  Only TensorFlow (and tensorflow-text for the tokenizer ops) is needed, which
+  keeps cold starts fast.
+  """
+
+  def __init__(self, path: str, batch_size: int = 32):
+    # Registers the SentencePiece ops used by the exported tokenizer.
+    import tensorflow_text  # pylint: disable=unused-import
+
+    self.path = path
+    self.batch_size = batch_size
+    self.saved_model = tf.saved_model.load(path)
+    self._serve = getattr(self.saved_model, _ENDPOINT_NAME)
+    with open(os.path.join(path, _METADATA_FILE)) as f:
+      self.metadata = json.load(f)
+
+  def __call__(self, prompts: Iterable[str]) -> numpy.ndarray:
+    """Predicts the token probabilities for a sequence of prompts."""
+    prompts = list(prompts)
+    outputs = []
+    for start in range(0, len(prompts), self.batch_size):
+      batch = tf.constant(prompts[start : start + self.batch_size])
+      outputs.append(self._serve(batch).numpy())
+    if not outputs:
+      return numpy.zeros((0, len(self.metadata.get("token_set", []))))
+    return numpy.concatenate(outputs, axis=0)
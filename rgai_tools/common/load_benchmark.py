@@ -0,0 +1,150 @@
+"""Benchmarks load time and peak memory of `model_loader.load_gemma_model`.
+
+Builds a Gemma preset with random weights locally (no download needed) and
+loads it in a fresh process for each mode, so the peak RSS of one load is not
+hidden by another. Building the preset requires the `sentencepiece` package.
+
+  python -m rgai_tools.common.load_benchmark --num-layers=8 --hidden-dim=1024
+"""
+
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from typing import TYPE_CHECKING
+
+import click
+
+from rgai_tools.common import model_loader
+
+if TYPE_CHECKING:
+  import keras_nlp
+
+_MODES = {"default": False, "streaming": True}
+_WORDS = ("the", "quick", "brown", "fox", "jumps", "over", "lazy", "dog")
+
+
+def build_model(
+    vocabulary_size: int,
+    num_layers: int,
+    hidden_dim: int,
+    words: tuple[str, ...] = _WORDS,
+) -> "keras_nlp.models.GemmaCausalLM":
+  """Builds a Gemma causal LM with random weights.
+
+  The tokenizer has one token per word in `words`, and maps any other word to
+  the unknown token.
+  """
+  import keras_nlp
+  import sentencepiece
+
+  proto = io.BytesIO()
+  sentencepiece.SentencePieceTrainer.train(
+      sentence_iterator=iter(words),
+      model_writer=proto,
+      vocab_size=len(set(words)) + 4,
+      hard_vocab_limit=False,
+      model_type="WORD",
+      pad_id=0,
+      bos_id=1,
+      eos_id=2,
+      unk_id=3,
+      pad_piece="<pad>",
+      bos_piece="<bos>",
+      eos_piece="<eos>",
+      unk_piece="<unk>",
+  )
+  tokenizer = keras_nlp.models.GemmaTokenizer(proto=proto.getvalue())
+
+  # The backbone vocabulary is independent of the tokenizer's, so the token
+  # embeddings can be sized like a real model's.
+  backbone = keras_nlp.models.GemmaBackbone(
+      vocabulary_size=vocabulary_size,
+      num_layers=num_layers,
+      num_query_heads=8,
+      num_key_value_heads=1,
+      hidden_dim=hidden_dim,
+      intermediate_dim=hidden_dim * 4,
+      head_dim=hidden_dim // 8,
+  )
+  preprocessor = keras_nlp.models.GemmaCausalLMPreprocessor(tokenizer)
+  return keras_nlp.models.GemmaCausalLM(
+      backbone=backbone, preprocessor=preprocessor
+  )
+
+
+def build_preset(
+    path: str,
+    vocabulary_size: int,
+    num_layers: int,
+    hidden_dim: int,
+) -> None:
+  """Saves a Gemma causal LM preset with random weights to `path`."""
+  build_model(vocabulary_size, num_layers, hidden_dim).save_to_preset(path)
+
+
+def _measure(preset: str, mode: str) -> dict[str, float]:
+  """Loads the preset in this process and returns the load statistics."""
+  baseline_rss = model_loader.peak_rss_bytes()
+  start_time = time.monotonic()
+  model = model_loader.load_gemma_model(
+      preset, stream_weights=_MODES[mode]
+  )
+  stats = {
+      "load_seconds": time.monotonic() - start_time,
+      "peak_rss_mib": model_loader.peak_rss_bytes() / 2**20,
+      "baseline_rss_mib": baseline_rss / 2**20,
+  }
+  # Measured after the peak RSS, since this copies each weight in turn.
+  weights_bytes = sum(w.numpy().nbytes for w in model.weights)
+  stats["weights_mib"] = weights_bytes / 2**20
+  return stats
+
+
+@click.command()
+@click.option("--preset", help="Preset to load instead of building one.")
+@click.option("--vocabulary-size", default=256000, show_default=True)
+@click.option("--num-layers", default=4, show_default=True)
+@click.option("--hidden-dim", default=512, show_default=True)
+@click.option(
+    "--measure",
+    type=click.Choice(list(_MODES)),
+    hidden=True,
+    help="Load the preset once and print the statistics as JSON.",
+)
+def benchmark(
+    *,
+    preset: str | None,
+    vocabulary_size: int,
+    num_layers: int,
+    hidden_dim: int,
+    measure: str | None,
+):
+  if measure:
+    click.echo(json.dumps(_measure(preset, measure)))
+    return
+
+  with tempfile.TemporaryDirectory() as tmpdir:
+    if not preset:
+      preset = os.path.join(tmpdir, "preset")
+      build_preset(preset, vocabulary_size, num_layers, hidden_dim)
+
+    for mode in _MODES:
+      command = [sys.executable, "-m", __spec__.name, "--preset", preset]
+      command += ["--measure", mode]
+      output = subprocess.run(
+          command, check=True, capture_output=True, text=True
+      ).stdout
+      stats = json.loads(output.strip().splitlines()[-1])
+      click.echo(
+          f"{mode:>10}: loaded {stats['weights_mib']:.0f} MiB of weights in "
+          f"{stats['load_seconds']:.2f}s, peak RSS {stats['peak_rss_mib']:.0f} "
+          f"MiB ({stats['baseline_rss_mib']:.0f} MiB before loading)"
+      )
+
+
+if __name__ == "__main__":
+  benchmark()
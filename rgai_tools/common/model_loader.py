@@ -1,16 +1,251 @@
+import os
+import resource
+import sys
+import threading
+import time
+from typing import TYPE_CHECKING
+
 from absl import logging
-import keras_nlp
+import h5py
+import keras
+import tensorflow as tf
+
+# Streaming weights relies on Keras and keras_nlp internals, whose versions are
+# pinned in requirements.txt. When they are missing, weights are loaded with
+# the public APIs instead.
+try:
+  from keras.src.saving import saving_lib
+except ImportError:
+  saving_lib = None
+
+# keras_nlp is slow to import, so it is only imported when a model is loaded.
+# This keeps it out of the CLIs and of loading exported models.
+if TYPE_CHECKING:
+  import keras_nlp
+
+# Process-wide registry of shared models, see `get_gemma_model`.
+_ModelKey = tuple[str, int, str | None]
+_MODEL_REGISTRY: dict[_ModelKey, "keras_nlp.models.CausalLM"] = {}
+_MODEL_REGISTRY_LOCK = threading.Lock()
+
+# Upper bound on the size of the weight slices read when streaming weights.
+_STREAMING_CHUNK_BYTES = 64 * 1024 * 1024
+
+
+def peak_rss_bytes() -> int:
+  """Returns the peak resident set size of this process so far."""
+  # Unlike `ru_maxrss`, the high water mark is not inherited from the parent
+  # process, which would hide the peak of a freshly started process.
+  if os.path.exists("/proc/self/status"):
+    with open("/proc/self/status") as f:
+      for line in f:
+        if line.startswith("VmHWM:"):
+          return int(line.split()[1]) * 1024
+
+  peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  # Linux reports kilobytes, macOS reports bytes.
+  return peak_rss if sys.platform == "darwin" else peak_rss * 1024
+
+
+class _VariableCollector:
+  """Weights store that records variables by path instead of saving them.
+
+  Passing it to Keras' own saving traversal yields the exact path under which
+  each variable is stored in a `.weights.h5` file.
+  """
+
+  def __init__(self):
+    self.variables: dict[str, keras.Variable] = {}
+
+  def make(self, path: str) -> "_VariableCollectorEntry":
+    return _VariableCollectorEntry(self, f"{path}/vars" if path else "vars")
+
+
+class _VariableCollectorEntry:
+
+  def __init__(self, collector: _VariableCollector, path: str):
+    self.collector = collector
+    self.path = path
+    self.keys = []
+
+  def __setitem__(self, key: str, variable: keras.Variable):
+    self.keys.append(key)
+    self.collector.variables[f"{self.path}/{key}"] = variable
+
+  def __len__(self) -> int:
+    return len(self.keys)
+
+
+def _stream_weights(model: keras.Model, weights_path: str) -> None:
+  """Assigns weights from a `.weights.h5` file in bounded-size slices."""
+  save_state = getattr(saving_lib, "_save_state", None)
+  if save_state is None:
+    logging.warning("Cannot stream weights with this Keras version.")
+    model.load_weights(weights_path)
+    return
+
+  collector = _VariableCollector()
+  save_state(
+      model,
+      weights_store=collector,
+      assets_store=None,
+      inner_path="",
+      visited_saveables=set(),
+  )
+
+  with h5py.File(weights_path, "r") as f:
+    for path, variable in collector.variables.items():
+      dataset = f[path]
+      if tuple(dataset.shape) != tuple(variable.shape):
+        raise ValueError(
+            f"Weight {path} has shape {dataset.shape} in {weights_path}, but "
+            f"the model expects shape {tuple(variable.shape)}."
+        )
+
+      # Only TensorFlow variables support assigning to a slice in place.
+      handle = getattr(variable.value, "handle", None)
+      if handle is None or not variable.shape:
+        variable.assign(dataset[()])
+        continue
+
+      row_bytes = max(dataset.dtype.itemsize * dataset.size // len(dataset), 1)
+      rows_per_chunk = max(_STREAMING_CHUNK_BYTES // row_bytes, 1)
+      for start in range(0, len(dataset), rows_per_chunk):
+        chunk = dataset[start : start + rows_per_chunk]
+        # Slicing the variable would read it and make the assignment copy the
+        # whole buffer, so the slice assignment op is called directly.
+        tf.raw_ops.ResourceStridedSliceAssign(
+            ref=handle,
+            begin=[start],
+            end=[start + len(chunk)],
+            strides=[1],
+            value=tf.cast(chunk, variable.dtype),
+        )
+
+
+def _get_preset_weights_path(preset: str) -> str | None:
+  """Returns the local path of the preset's weights file, if it has one."""
+  try:
+    from keras_nlp.src.utils import preset_utils
+
+    if not preset_utils.check_file_exists(
+        preset, preset_utils.MODEL_WEIGHTS_FILE
+    ):
+      return None
+    return preset_utils.get_file(preset, preset_utils.MODEL_WEIGHTS_FILE)
+  except (ImportError, AttributeError):
+    logging.warning("Cannot stream weights with this keras_nlp version.")
+    return None
+
+
+def _load_gemma_model_streaming(
+    preset: str,
+    weights_path: str,
+    dtype: str | None = None,
+) -> "keras_nlp.models.CausalLM":
+  import keras_nlp
+
+  # Build the backbone without materializing randomly initialized weights; the
+  # variables are created once, zero-filled, when leaving the stateless scope.
+  with keras.StatelessScope():
+    backbone = keras_nlp.models.GemmaBackbone.from_preset(
+        preset, load_weights=False, dtype=dtype
+    )
+    for variable in backbone.weights:
+      if hasattr(variable, "_initializer"):
+        variable._initializer = keras.initializers.Zeros()  # pylint: disable=protected-access
+
+  _stream_weights(backbone, weights_path)
+
+  # The LM head reuses the backbone's token embeddings, so the task adds no
+  # weights of its own.
+  preprocessor = keras_nlp.models.GemmaCausalLMPreprocessor.from_preset(preset)
+  return keras_nlp.models.GemmaCausalLM(
+      backbone=backbone, preprocessor=preprocessor
+  )
 
 
 def load_gemma_model(
     preset: str,
     max_sequence_length: int = 512,
-) -> keras_nlp.models.CausalLM:
+    dtype: str | None = None,
+    stream_weights: bool = False,
+) -> "keras_nlp.models.CausalLM":
+  """Loads a Gemma causal LM from a preset.
+
+  With `stream_weights`, the weights are read from the preset file in slices
+  of bounded size and assigned in place, instead of initializing every weight
+  randomly and then loading each one in full. This lowers the peak memory
+  used while loading and skips the random initialization. Only presets in the
+  Keras format support streaming; other presets are loaded as usual.
+
+  Streaming relies on Keras and keras_nlp internals of the versions pinned in
+  requirements.txt. With other versions, it falls back to loading the weights
+  in full with the public APIs.
+  """
+  import keras_nlp
+
   # Load the model from preset.
   logging.info("Loading model from preset %s", preset)
-  model = keras_nlp.models.GemmaCausalLM.from_preset(preset)
+  start_time = time.monotonic()
+  weights_path = _get_preset_weights_path(preset) if stream_weights else None
+  if weights_path:
+    model = _load_gemma_model_streaming(preset, weights_path, dtype=dtype)
+  else:
+    model = keras_nlp.models.GemmaCausalLM.from_preset(preset, dtype=dtype)
+  logging.info(
+      "Loaded model from preset %s in %.1fs, peak RSS %.1f MiB",
+      preset,
+      time.monotonic() - start_time,
+      peak_rss_bytes() / 2**20,
+  )
 
   # Update the model's sequence length to ensure it doesn't run out of memory.
   model.preprocessor.sequence_length = max_sequence_length
 
   return model
+
+
+def get_gemma_model(
+    preset: str,
+    max_sequence_length: int = 512,
+    dtype: str | None = None,
+    stream_weights: bool = False,
+) -> "keras_nlp.models.CausalLM":
+  """Returns a shared model instance, loading it on first use.
+
+  Every caller asking for the same (preset, sequence length, dtype) gets the
+  same instance, so the weights are only held in memory once. Callers that
+  modify the model (e.g. enabling LoRA for training) should use
+  `load_gemma_model` instead.
+  """
+  key = (preset, max_sequence_length, dtype)
+  with _MODEL_REGISTRY_LOCK:
+    if key not in _MODEL_REGISTRY:
+      _MODEL_REGISTRY[key] = load_gemma_model(
+          preset,
+          max_sequence_length=max_sequence_length,
+          dtype=dtype,
+          stream_weights=stream_weights,
+      )
+    return _MODEL_REGISTRY[key]
+
+
+def get_sampler(identifier: str | dict) -> "keras_nlp.samplers.Sampler":
+  """Returns the keras_nlp sampler with the given name or config."""
+  import keras_nlp
+
+  return keras_nlp.samplers.get(identifier)
+
+
+def init_preprocessing_thread() -> None:
+  """Allows keras_nlp preprocessing on the calling thread.
+
+  keras_nlp only sets its thread-local conversion counter on the thread that
+  imports it, which makes preprocessing fail when called from any other
+  thread. This should be called once on each such thread.
+  """
+  from keras_nlp.src.utils import tensor_utils
+
+  if not hasattr(tensor_utils.NO_CONVERT_COUNTER, "count"):
+    tensor_utils.NO_CONVERT_COUNTER.count = 0
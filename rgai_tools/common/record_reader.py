@@ -0,0 +1,252 @@
+import csv
+import io
+import itertools
+import json
+import multiprocessing
+import os
+import sys
+from typing import Any, Callable, Iterable, Iterator, NamedTuple, Sequence
+
+from absl import logging
+import json5
+
+_FORMATS_BY_EXTENSION = {
+    ".json": "json",
+    ".jsonl": "jsonl",
+    ".ndjson": "jsonl",
+    ".csv": "csv",
+    ".parquet": "parquet",
+    ".pq": "parquet",
+}
+_PARQUET_BATCH_SIZE = 1024
+_WORKER_CHUNK_SIZE = 256
+
+
+class RecordError(NamedTuple):
+  """A record which could not be parsed, validated or transformed."""
+
+  line_number: int
+  content: str
+  error: str
+
+
+def _log_error(error: RecordError) -> None:
+  logging.warning(
+      "Skipping record at line %d: %s (%s)",
+      error.line_number,
+      error.error,
+      error.content[:200],
+  )
+
+
+def parse_json_line(line: str) -> Any:
+  """Parses a line as strict JSON, falling back to JSON5 if that fails."""
+  try:
+    return json.loads(line)
+  except ValueError:
+    return json5.loads(line)
+
+
+def _parse_numbered_line(item: tuple[int, str]) -> tuple[int, str, Any, str]:
+  line_number, line = item
+  try:
+    return line_number, line, parse_json_line(line), ""
+  except Exception as exc:
+    return line_number, line, None, f"{type(exc).__name__}: {exc}"
+
+
+def _iter_jsonl(
+    lines: Iterable[str],
+    num_workers: int,
+) -> Iterator[tuple[int, str, Any, str]]:
+  numbered = (
+      (i, line.strip()) for i, line in enumerate(lines, start=1) if line.strip()
+  )
+  if num_workers <= 1:
+    yield from map(_parse_numbered_line, numbered)
+    return
+
+  # Parse bounded batches so the whole input is never read ahead in memory.
+  batch_size = num_workers * _WORKER_CHUNK_SIZE * 4
+  with multiprocessing.Pool(num_workers) as pool:
+    while batch := list(itertools.islice(numbered, batch_size)):
+      yield from pool.map(
+          _parse_numbered_line, batch, chunksize=_WORKER_CHUNK_SIZE
+      )
+
+
+def _is_json_array(path: str) -> bool:
+  """Returns whether the first non-blank character of a file is a '['."""
+  with open(path) as f:
+    while char := f.read(1):
+      if not char.isspace():
+        return char == "["
+  return False
+
+
+def _iter_json_array(path: str) -> Iterator[tuple[int, str, Any, str]]:
+  # A top-level array can only be parsed as a whole, so this is not lazy.
+  with open(path) as f:
+    try:
+      records = parse_json_line(f.read())
+    except Exception as exc:
+      raise ValueError(f"Failed to parse {path} as a JSON array: {exc}") from exc
+  for i, record in enumerate(records, start=1):
+    yield i, json.dumps(record), record, ""
+
+
+def _format_csv_row(values: Sequence[str]) -> str:
+  content = io.StringIO()
+  csv.writer(content, lineterminator="").writerow(values)
+  return content.getvalue()
+
+
+def _iter_csv(lines: Iterable[str]) -> Iterator[tuple[int, str, Any, str]]:
+  reader = csv.reader(lines)
+  header = next(reader, None)
+  for values in reader:
+    # Like `csv.DictReader`, skip blank rows.
+    if not values:
+      continue
+    content = _format_csv_row(values)
+    if len(values) != len(header):
+      error = f"Expected {len(header)} columns, got {len(values)}"
+      yield reader.line_num, content, None, error
+      continue
+    yield reader.line_num, content, dict(zip(header, values)), ""
+
+
+def _iter_parquet(path: str) -> Iterator[tuple[int, str, Any, str]]:
+  try:
+    from pyarrow import parquet
+  except ImportError:
+    # Fall back to pandas, which has to load the whole file at once.
+    import pandas
+
+    rows = pandas.read_parquet(path).to_dict(orient="records")
+    for i, row in enumerate(rows, start=1):
+      yield i, str(row), row, ""
+    return
+
+  row_number = 0
+  for batch in parquet.ParquetFile(path).iter_batches(_PARQUET_BATCH_SIZE):
+    for row in batch.to_pylist():
+      row_number += 1
+      yield row_number, str(row), row, ""
+
+
+def infer_format(path: str | None) -> str:
+  """Infers the input format from a file extension, defaulting to JSONL."""
+  if not path or path == "-":
+    return "jsonl"
+  extension = os.path.splitext(path)[1].lower()
+  return _FORMATS_BY_EXTENSION.get(extension, "jsonl")
+
+
+def read_records(
+    path: str | None = None,
+    *,
+    input_format: str | None = None,
+    required_fields: Sequence[str] = (),
+    transform: Callable[[dict[str, Any]], Any] | None = None,
+    num_workers: int = 0,
+    on_error: Callable[[RecordError], None] = _log_error,
+    max_errors: int | None = None,
+) -> Iterator[Any]:
+  """Lazily reads records from stdin or a JSON(L), CSV or Parquet file.
+
+  JSONL lines are parsed with the stdlib JSON parser, and only lines which fail
+  to parse are retried with the (much slower) JSON5 parser. JSON files holding
+  a top-level array are parsed as a whole, and their records numbered by
+  position instead of line; other JSON files are read as JSONL. Records which
+  fail to parse, miss a required field or raise in `transform` are reported to
+  `on_error` and skipped rather than aborting the whole read.
+
+  Args:
+    path: Path to the input file. Reads from stdin if None or "-".
+    input_format: One of "json", "jsonl", "csv" or "parquet". Inferred from
+      the file extension if not given.
+    required_fields: Fields that every record must contain.
+    transform: Optional function applied to each valid record.
+    num_workers: Number of worker processes used to parse JSONL lines.
+    on_error: Callback invoked for every skipped record.
+    max_errors: Maximum number of skipped records before raising an error.
+
+  Yields:
+    The parsed (and transformed) records, in input order.
+  """
+  input_format = input_format or infer_format(path)
+  from_stdin = not path or path == "-"
+
+  if input_format == "parquet":
+    if from_stdin:
+      raise ValueError("Parquet input must be read from a file.")
+    yield from _read(
+        _iter_parquet(path),
+        required_fields,
+        transform,
+        on_error,
+        max_errors,
+    )
+    return
+
+  if input_format == "json":
+    if from_stdin or not _is_json_array(path):
+      # Files of JSON lines are often named `.json` too.
+      input_format = "jsonl"
+    else:
+      yield from _read(
+          _iter_json_array(path),
+          required_fields,
+          transform,
+          on_error,
+          max_errors,
+      )
+      return
+
+  if input_format not in ("jsonl", "csv"):
+    raise ValueError(f"Unsupported input format: {input_format}")
+
+  lines = sys.stdin if from_stdin else open(path, newline="")
+  try:
+    if input_format == "csv":
+      items = _iter_csv(lines)
+    else:
+      items = _iter_jsonl(lines, num_workers)
+    yield from _read(items, required_fields, transform, on_error, max_errors)
+  finally:
+    if not from_stdin:
+      lines.close()
+
+
+def _read(
+    items: Iterable[tuple[int, str, Any, str]],
+    required_fields: Sequence[str],
+    transform: Callable[[dict[str, Any]], Any] | None,
+    on_error: Callable[[RecordError], None],
+    max_errors: int | None,
+) -> Iterator[Any]:
+  error_count = 0
+  for line_number, content, record, error in items:
+    if not error:
+      if not isinstance(record, dict):
+        error = f"Expected a JSON object, got {type(record).__name__}"
+      elif missing := [k for k in required_fields if k not in record]:
+        error = f"Missing required fields: {', '.join(missing)}"
+      elif transform is not None:
+        try:
+          record = transform(record)
+        except Exception as exc:
+          error = f"{type(exc).__name__}: {exc}"
+
+    if error:
+      error_count += 1
+      on_error(RecordError(line_number, content, error))
+      if max_errors is not None and error_count > max_errors:
+        raise ValueError(f"Too many invalid records ({error_count}).")
+      continue
+
+    yield record
+
+  if error_count:
+    logging.warning("Skipped %d invalid records", error_count)
@@ -0,0 +1,192 @@
+import bisect
+from typing import Any, Callable, Sequence
+
+from absl import logging
+import keras
+import numpy
+
+_DEFAULT_BATCH_SIZES = (1, 8, 32)
+_MIN_SEQUENCE_BUCKET = 32
+
+
+def _default_sequence_lengths(max_sequence_length: int) -> tuple[int, ...]:
+  """Powers of two up to (and including) the maximum sequence length."""
+  lengths = []
+  length = _MIN_SEQUENCE_BUCKET
+  while length < max_sequence_length:
+    lengths.append(length)
+    length *= 2
+  lengths.append(max_sequence_length)
+  return tuple(lengths)
+
+
+class ScoringFunction:
+  """Compiled, shape-stable wrapper around a model taking token inputs.
+
+  This is mainly used for token probability models, but works with any model
+  taking `token_ids` and `padding_mask` and returning one output per row.
+
+  Inputs are padded to one of a fixed set of (batch, length) buckets before
+  being handed to the model, so the compiled graph is only ever traced once per
+  bucket. Batches larger than the biggest batch bucket are split into chunks.
+  """
+
+  def __init__(
+      self,
+      probability_model: keras.Model,
+      max_sequence_length: int,
+      batch_sizes: Sequence[int] = _DEFAULT_BATCH_SIZES,
+      sequence_lengths: Sequence[int] | None = None,
+      jit_compile: bool = True,
+  ):
+    self.probability_model = probability_model
+    self.batch_sizes = tuple(sorted(set(batch_sizes)))
+    self.sequence_lengths = tuple(
+        sorted(
+            set(
+                sequence_lengths
+                or _default_sequence_lengths(max_sequence_length)
+            )
+        )
+    )
+    if self.sequence_lengths[-1] < max_sequence_length:
+      raise ValueError(
+          f"Largest sequence length bucket {self.sequence_lengths[-1]} is "
+          f"smaller than the maximum sequence length {max_sequence_length}."
+      )
+    self.jit_compile = jit_compile
+    self.trace_count = 0
+    self._variable_count = len(probability_model.weights)
+    self._compiled_fn = self._build_compiled_fn()
+
+  def _maybe_rebuild(self) -> None:
+    # Compiled graphs capture the variables they read when traced, so variables
+    # added later (e.g. by enabling LoRA) would be ignored without a rebuild.
+    variable_count = len(self.probability_model.weights)
+    if variable_count != self._variable_count:
+      logging.info("Model variables changed, rebuilding scoring function")
+      self._variable_count = variable_count
+      self._compiled_fn = self._build_compiled_fn()
+
+  def _build_compiled_fn(self) -> Callable[[dict[str, Any]], Any]:
+    """Builds the compiled forward pass for the current Keras backend."""
+    backend = keras.backend.backend()
+    model = self.probability_model
+
+    if backend == "tensorflow":
+      import tensorflow as tf
+
+      def forward(inputs):
+        # Python side effects only run while tracing, which lets us count them.
+        self.trace_count += 1
+        return model(inputs, training=False)
+
+      return tf.function(
+          forward,
+          jit_compile=self.jit_compile,
+          reduce_retracing=False,
+      )
+
+    if backend == "jax":
+      import jax
+
+      def stateless_forward(trainable, non_trainable, inputs):
+        self.trace_count += 1
+        outputs, _ = model.stateless_call(
+            trainable, non_trainable, inputs, training=False
+        )
+        return outputs
+
+      jitted = stateless_forward
+      if self.jit_compile:
+        jitted = jax.jit(stateless_forward)
+
+      def forward(inputs):
+        # Read the variables on every call so updates (e.g. LoRA training) are
+        # reflected without retracing.
+        trainable = [v.value for v in model.trainable_variables]
+        non_trainable = [v.value for v in model.non_trainable_variables]
+        return jitted(trainable, non_trainable, inputs)
+
+      return forward
+
+    logging.warning("No compiled scoring path for backend %s", backend)
+
+    def forward(inputs):
+      self.trace_count += 1
+      return model(inputs, training=False)
+
+    return forward
+
+  def _bucket(self, buckets: tuple[int, ...], size: int) -> int:
+    return buckets[min(bisect.bisect_left(buckets, size), len(buckets) - 1)]
+
+  def _score_chunk(
+      self,
+      token_ids: numpy.ndarray,
+      padding_mask: numpy.ndarray,
+  ) -> numpy.ndarray:
+    batch_size = token_ids.shape[0]
+    used_length = max(int(padding_mask.sum(axis=1).max()), 1)
+    batch_bucket = self._bucket(self.batch_sizes, batch_size)
+    length_bucket = self._bucket(self.sequence_lengths, used_length)
+
+    padded_ids = numpy.zeros((batch_bucket, length_bucket), dtype="int32")
+    padded_mask = numpy.zeros((batch_bucket, length_bucket), dtype="bool")
+    length = min(length_bucket, token_ids.shape[1])
+    padded_ids[:batch_size, :length] = token_ids[:, :length]
+    padded_mask[:batch_size, :length] = padding_mask[:, :length]
+
+    # Filler rows get a single unmasked token so the "last prompt token" lookup
+    # stays in range; their outputs are discarded below.
+    padded_mask[batch_size:, 0] = True
+
+    inputs = {"token_ids": padded_ids, "padding_mask": padded_mask}
+    outputs = self._compiled_fn(inputs)
+    return keras.ops.convert_to_numpy(outputs)[:batch_size]
+
+  def __call__(self, inputs: dict[str, Any]) -> numpy.ndarray:
+    """Scores preprocessed inputs with `token_ids` and `padding_mask` keys."""
+    self._maybe_rebuild()
+    token_ids = keras.ops.convert_to_numpy(inputs["token_ids"])
+    padding_mask = keras.ops.convert_to_numpy(inputs["padding_mask"])
+
+    max_batch = self.batch_sizes[-1]
+    outputs = []
+    for start in range(0, token_ids.shape[0], max_batch):
+      end = start + max_batch
+      outputs.append(
+          self._score_chunk(token_ids[start:end], padding_mask[start:end])
+      )
+
+    if not outputs:
+      return numpy.zeros((0, self.probability_model.output.shape[-1]))
+    return numpy.concatenate(outputs, axis=0)
+
+  def warmup(
+      self,
+      batch_sizes: Sequence[int] | None = None,
+      sequence_lengths: Sequence[int] | None = None,
+  ) -> None:
+    """Traces and compiles the buckets of the given sizes ahead of time.
+
+    Each size is rounded up to its bucket. By default only the largest batch
+    and length buckets are compiled, which is what large inputs are split into;
+    compiling every bucket would make loading as slow as the first requests.
+    """
+    self._maybe_rebuild()
+    batch_buckets = sorted({
+        self._bucket(self.batch_sizes, size)
+        for size in batch_sizes or self.batch_sizes[-1:]
+    })
+    length_buckets = sorted({
+        self._bucket(self.sequence_lengths, length)
+        for length in sequence_lengths or self.sequence_lengths[-1:]
+    })
+    for batch_size in batch_buckets:
+      for length in length_buckets:
+        logging.info("Warming up scoring shape (%d, %d)", batch_size, length)
+        token_ids = numpy.zeros((batch_size, length), dtype="int32")
+        padding_mask = numpy.ones((batch_size, length), dtype="bool")
+        self._score_chunk(token_ids, padding_mask)
+    logging.info("Scoring function warmed up after %d traces", self.trace_count)
@@ -0,0 +1,139 @@
+from typing import Sequence, TYPE_CHECKING
+
+import keras
+import numpy
+
+if TYPE_CHECKING:
+  import keras_nlp
+
+
+def tokenize(
+    preprocessor: "keras_nlp.models.CausalLMPreprocessor",
+    texts: Sequence[str],
+) -> list[list[int]]:
+  """Tokenizes texts for training, like the preprocessor does for one row.
+
+  Each sequence gets the start and end tokens, and is truncated to the
+  preprocessor's sequence length (plus the token that is only used as a label).
+  """
+  tokenizer = preprocessor.tokenizer
+  max_length = preprocessor.sequence_length + 1
+  start = [tokenizer.start_token_id] if preprocessor.add_start_token else []
+  end = [tokenizer.end_token_id] if preprocessor.add_end_token else []
+  max_tokens = max_length - len(start) - len(end)
+  token_ids = tokenizer(list(texts))
+  return [start + list(row[:max_tokens]) + end for row in token_ids]
+
+
+def pack(
+    sequences: Sequence[Sequence[int]],
+    length: int,
+    pad_token_id: int = 0,
+) -> tuple[numpy.ndarray, numpy.ndarray]:
+  """Packs sequences into rows of `length` tokens, longest first.
+
+  Every sequence is placed in the first row with enough room left for it.
+
+  Returns:
+    A (token_ids, segment_ids) tuple of arrays of shape `(rows, length)`. The
+    segment IDs number the sequences within each row from 1, with 0 marking
+    padding.
+  """
+  rows, room = [], []
+  for index in sorted(range(len(sequences)), key=lambda i: -len(sequences[i])):
+    sequence_length = len(sequences[index])
+    if sequence_length > length:
+      raise ValueError(
+          f"Sequence of length {sequence_length} does not fit in rows of "
+          f"length {length}."
+      )
+    for row, row_room in enumerate(room):
+      if sequence_length <= row_room:
+        break
+    else:
+      row = len(rows)
+      rows.append([])
+      room.append(length)
+    rows[row].append(index)
+    room[row] -= sequence_length
+
+  token_ids = numpy.full((len(rows), length), pad_token_id, dtype="int32")
+  segment_ids = numpy.zeros((len(rows), length), dtype="int32")
+  for row, indices in enumerate(rows):
+    offset = 0
+    for segment_id, index in enumerate(indices, start=1):
+      sequence = sequences[index]
+      token_ids[row, offset : offset + len(sequence)] = sequence
+      segment_ids[row, offset : offset + len(sequence)] = segment_id
+      offset += len(sequence)
+  return token_ids, segment_ids
+
+
+def to_training_data(
+    token_ids: numpy.ndarray,
+    segment_ids: numpy.ndarray,
+) -> tuple[dict[str, numpy.ndarray], numpy.ndarray, numpy.ndarray]:
+  """Splits packed rows into (x, y, sample_weight) for next token prediction.
+
+  Only predictions of the next token of the same sequence are weighted, so no
+  loss is computed across sequence boundaries or on padding.
+  """
+  x = {"token_ids": token_ids[:, :-1], "segment_ids": segment_ids[:, :-1]}
+  y = token_ids[:, 1:]
+  same_segment = segment_ids[:, 1:] == segment_ids[:, :-1]
+  sample_weight = same_segment & (segment_ids[:, 1:] > 0)
+  return x, y, sample_weight.astype("float32")
+
+
+def segment_attention_mask(segment_ids):
+  """Causal attention mask that only attends within the same segment."""
+  length = keras.ops.shape(segment_ids)[1]
+  positions = keras.ops.arange(length)
+  causal_mask = positions[:, None] >= positions[None, :]
+  same_segment = segment_ids[:, :, None] == segment_ids[:, None, :]
+  return keras.ops.cast(
+      keras.ops.logical_and(causal_mask[None], same_segment), "int32"
+  )
+
+
+class PackedGemmaCausalLM(keras.Model):
+  """Forward pass of a Gemma causal LM over packed sequences, for training.
+
+  Shares all the layers (and weights) of the backbone, but replaces the
+  causal padding mask with `segment_attention_mask`. Positions are not reset
+  between sequences, since rotary embeddings only depend on the relative
+  positions of the tokens that attend to each other.
+  """
+
+  def __init__(self, backbone: "keras_nlp.models.GemmaBackbone", **kwargs):
+    super().__init__(**kwargs)
+    self.backbone = backbone
+
+  def _decoder_block(self, block, x, attention_mask):
+    # Same as `GemmaDecoderBlock.call` without cache, but with the given mask.
+    normalized_x = block.pre_attention_norm(x)
+    attention = block.attention(normalized_x, attention_mask=attention_mask)
+    if block.use_post_attention_norm:
+      attention = block.post_attention_norm(attention)
+    if block.dropout:
+      attention = block.attention_dropout(attention)
+
+    attention_x = x + attention
+    normalized_x = block.pre_ffw_norm(attention_x)
+    x1 = block.gating_ffw(normalized_x)
+    x2 = block.gating_ffw_2(normalized_x)
+    x = keras.activations.gelu(x1, approximate=True) * x2
+    x = block.ffw_linear(x)
+    if block.use_post_ffw_norm:
+      x = block.post_ffw_norm(x)
+    return x + attention_x
+
+  def call(self, inputs):
+    backbone = self.backbone
+    attention_mask = segment_attention_mask(inputs["segment_ids"])
+    x = backbone.token_embedding(inputs["token_ids"])
+    x = x * keras.ops.cast(keras.ops.sqrt(backbone.hidden_dim), x.dtype)
+    for block in backbone.transformer_layers:
+      x = self._decoder_block(block, x, attention_mask)
+    x = backbone.layer_norm(x)
+    return backbone.token_embedding(x, reverse=True)
@@ -0,0 +1,122 @@
+"""Benchmarks speculative decoding against target-only greedy `generate`.
+
+Builds a target Gemma model with random weights and a draft model that shares
+its embeddings and first layers, so that its proposals agree with the target
+often enough to be useful. Reports the speedup over greedy `generate` of
+speculative decoding with that draft, and with the target as its own draft
+(every proposal accepted). Acceptance rates of models with random weights are
+not representative of trained ones, so the draft results mostly show the
+decoding overhead. Building the models requires the `sentencepiece` package.
+
+  python -m rgai_tools.common.speculative_benchmark --num-layers=6
+"""
+
+import random
+import time
+
+import click
+import keras_nlp
+
+from rgai_tools.common import load_benchmark
+from rgai_tools.common import speculative_decoding
+
+def _build_draft(
+    target: keras_nlp.models.GemmaCausalLM,
+    num_layers: int,
+    words: tuple[str, ...],
+) -> keras_nlp.models.GemmaCausalLM:
+  """Builds a draft model from the embeddings and first layers of the target."""
+  backbone = target.backbone
+  draft = load_benchmark.build_model(
+      vocabulary_size=backbone.vocabulary_size,
+      num_layers=num_layers,
+      hidden_dim=backbone.hidden_dim,
+      words=words,
+  )
+  draft_backbone = draft.backbone
+  draft_backbone.token_embedding.set_weights(
+      backbone.token_embedding.get_weights()
+  )
+  draft_backbone.layer_norm.set_weights(backbone.layer_norm.get_weights())
+  for draft_layer, layer in zip(
+      draft_backbone.transformer_layers, backbone.transformer_layers
+  ):
+    draft_layer.set_weights(layer.get_weights())
+  return draft
+
+
+def _time_generation(generate, prompts: list[str], repeats: int) -> float:
+  # The first call includes tracing and compilation, so it is not timed.
+  generate(prompts)
+  start_time = time.monotonic()
+  for _ in range(repeats):
+    generate(prompts)
+  return (time.monotonic() - start_time) / repeats
+
+
+@click.command()
+@click.option("--batch-size", default=8, show_default=True)
+@click.option("--max-length", default=128, show_default=True)
+@click.option("--num-draft-tokens", default=4, show_default=True)
+@click.option("--repeats", default=3, show_default=True)
+@click.option("--vocabulary-size", default=1024, show_default=True)
+@click.option("--num-layers", default=6, show_default=True)
+@click.option("--draft-num-layers", default=1, show_default=True)
+@click.option("--hidden-dim", default=256, show_default=True)
+def benchmark(
+    *,
+    batch_size: int,
+    max_length: int,
+    num_draft_tokens: int,
+    repeats: int,
+    vocabulary_size: int,
+    num_layers: int,
+    draft_num_layers: int,
+    hidden_dim: int,
+):
+  # Generated tokens are detokenized, so the tokenizer needs one word for
+  # every token of the model vocabulary (besides the 4 special tokens).
+  words = tuple(f"word{i}" for i in range(vocabulary_size - 4))
+  target = load_benchmark.build_model(
+      vocabulary_size=vocabulary_size,
+      num_layers=num_layers,
+      hidden_dim=hidden_dim,
+      words=words,
+  )
+  target.compile(sampler="greedy")
+  draft = _build_draft(target, draft_num_layers, words)
+
+  rng = random.Random(0)
+  prompts = [
+      " ".join(rng.choices(words, k=rng.randint(1, 8)))
+      for _ in range(batch_size)
+  ]
+
+  # Without stop tokens, every row is generated up to the maximum length.
+  baseline = _time_generation(
+      lambda x: target.generate(x, max_length=max_length, stop_token_ids=None),
+      prompts,
+      repeats,
+  )
+  tokens = batch_size * max_length
+  click.echo(f"{'target':>8}: {tokens / baseline:.1f} positions/sec")
+
+  for name, draft_model in (("draft", draft), ("target", target)):
+    decoder = speculative_decoding.SpeculativeDecoder(
+        target, draft_model, num_draft_tokens=num_draft_tokens
+    )
+    seconds = _time_generation(
+        lambda x: decoder.generate(x, max_length=max_length, stop_token_ids=()),
+        prompts,
+        repeats,
+    )
+    click.echo(
+        f"{name:>8}: {tokens / seconds:.1f} positions/sec, speedup "
+        f"{baseline / seconds:.2f}x, acceptance rate "
+        f"{decoder.stats.acceptance_rate:.1%}, compiled in "
+        f"{decoder.stats.compile_seconds:.1f}s"
+    )
+
+
+if __name__ == "__main__":
+  benchmark()
@@ -0,0 +1,332 @@
+import time
+from typing import TYPE_CHECKING
+
+from absl import logging
+import keras
+import numpy
+
+if TYPE_CHECKING:
+  import keras_nlp
+
+
+class SpeculativeDecodingStats:
+  """Running statistics for speculative decoding."""
+
+  def __init__(self):
+    self.proposed_tokens = 0
+    self.accepted_tokens = 0
+    self.generated_tokens = 0
+    self.decoded_positions = 0
+    self.target_steps = 0
+    self.elapsed_seconds = 0.0
+    self.compile_seconds = 0.0
+
+  @property
+  def acceptance_rate(self) -> float:
+    """Fraction of draft tokens accepted by the target model."""
+    return self.accepted_tokens / max(self.proposed_tokens, 1)
+
+  @property
+  def positions_per_target_step(self) -> float:
+    """Positions decoded per target forward pass (1.0 without speculation)."""
+    return self.decoded_positions / max(self.target_steps, 1)
+
+  @property
+  def tokens_per_second(self) -> float:
+    """Generated tokens per second, not counting compilation."""
+    return self.generated_tokens / max(self.elapsed_seconds, 1e-9)
+
+  def __str__(self) -> str:
+    return (
+        f"acceptance rate {self.acceptance_rate:.1%}, "
+        f"{self.positions_per_target_step:.2f} positions per target step, "
+        f"{self.tokens_per_second:.1f} tokens/sec, "
+        f"{self.compile_seconds:.1f}s compiling"
+    )
+
+
+class SpeculativeDecoder:
+  """Greedy speculative decoding with a small draft model.
+
+  The draft model proposes `num_draft_tokens` tokens autoregressively, and the
+  target model scores all of them in a single forward pass. The longest prefix
+  matching the target's own greedy choices is kept, plus the target's token at
+  the first mismatch, so the output is the same as greedy decoding with the
+  target model alone. Both models must share the same tokenizer.
+
+  The model caches are updated at a single index for the whole batch, so all
+  rows advance together, by the shortest prefix accepted among the rows still
+  generating. A batch is therefore only as fast as its row with the fewest
+  accepted tokens. `stats.acceptance_rate` counts the tokens each row accepted
+  on its own, while `stats.positions_per_target_step` shows how far the batch
+  actually advanced.
+
+  Decoding is compiled once per batch size, length and stop tokens. The first
+  call with a new shape compiles ahead of decoding, and the time it takes is
+  reported in `stats.compile_seconds` instead of `stats.elapsed_seconds`.
+  """
+
+  def __init__(
+      self,
+      target: "keras_nlp.models.CausalLM",
+      draft: "keras_nlp.models.CausalLM",
+      num_draft_tokens: int = 4,
+  ):
+    target_vocab = target.backbone.vocabulary_size
+    draft_vocab = draft.backbone.vocabulary_size
+    if target_vocab != draft_vocab:
+      raise ValueError(
+          f"Draft model vocabulary size ({draft_vocab}) does not match the "
+          f"target model vocabulary size ({target_vocab})."
+      )
+    if num_draft_tokens < 1:
+      raise ValueError("num_draft_tokens must be a positive integer")
+    self.target = target
+    self.draft = draft
+    self.num_draft_tokens = num_draft_tokens
+    self.stats = SpeculativeDecodingStats()
+    self._generate_fn = None
+    self._compiled_keys = set()
+
+  def _seed_cache(self, model: "keras_nlp.models.CausalLM", token_ids):
+    backbone = model.backbone
+    batch_size, max_length = keras.ops.shape(token_ids)
+    shape = [
+        batch_size,
+        backbone.num_layers,
+        2,
+        max_length,
+        backbone.num_key_value_heads,
+        backbone.head_dim,
+    ]
+    cache = keras.ops.zeros(shape, dtype=model.compute_dtype)
+    _, _, cache = model.call_with_cache(token_ids, cache, 0)
+    return cache
+
+  def _step(self, token_ids, padding_mask, draft_cache, target_cache, index, done):
+    """Proposes and verifies `num_draft_tokens` tokens starting at `index`.
+
+    Returns:
+      The updated token IDs and caches, the number of new positions, and the
+      number of draft tokens accepted for each row.
+    """
+    k = self.num_draft_tokens
+    batch_size = token_ids.shape[0]
+
+    def window(x, start, length):
+      return keras.ops.slice(x, [0, start], [batch_size, length])
+
+    # The draft model proposes positions [index, index + k). It also runs on
+    # the last proposal, only to keep its cache complete for the next step.
+    proposal = token_ids
+    for i in range(k + 1):
+      position = index - 1 + i
+      logits, _, draft_cache = self.draft.call_with_cache(
+          window(proposal, position, 1), draft_cache, position
+      )
+      if i == k:
+        break
+      next_token = keras.ops.argmax(logits[:, 0], axis=-1)
+      next_token = keras.ops.where(
+          window(padding_mask, position + 1, 1)[:, 0],
+          window(token_ids, position + 1, 1)[:, 0],
+          keras.ops.cast(next_token, token_ids.dtype),
+      )
+      proposal = keras.ops.slice_update(
+          proposal, [0, position + 1], next_token[:, None]
+      )
+
+    # The target model scores all proposals in one pass, which also yields
+    # its own choice for the position right after the last proposal.
+    logits, _, target_cache = self.target.call_with_cache(
+        window(proposal, index - 1, k + 1), target_cache, index - 1
+    )
+    target_tokens = keras.ops.where(
+        window(padding_mask, index, k + 1),
+        window(token_ids, index, k + 1),
+        keras.ops.cast(keras.ops.argmax(logits, axis=-1), token_ids.dtype),
+    )
+
+    # Keep the prefix accepted by every active row, plus one target token.
+    matches = window(proposal, index, k) == target_tokens[:, :k]
+    accepted = keras.ops.sum(
+        keras.ops.cumprod(keras.ops.cast(matches, "int32"), axis=1), axis=1
+    )
+    num_new = keras.ops.min(keras.ops.where(done, k, accepted)) + 1
+    keep = keras.ops.arange(k + 1)[None, :] < num_new
+    new_tokens = keras.ops.where(
+        keep, target_tokens, window(token_ids, index, k + 1)
+    )
+    token_ids = keras.ops.slice_update(token_ids, [0, index], new_tokens)
+    return token_ids, draft_cache, target_cache, num_new, accepted
+
+  def _generate_step(self, token_ids, padding_mask, stop_token_ids):
+    """Decodes padded inputs, returning the token IDs and the step counts.
+
+    `token_ids` must have `num_draft_tokens + 1` positions of padding past the
+    maximum length, so every step fits in with fixed shapes. Like the generate
+    step of keras_nlp, the whole loop runs in the graph, with the index as a
+    loop variable.
+    """
+    k = self.num_draft_tokens
+    batch_size, padded_length = token_ids.shape
+    max_length = padded_length - k - 1
+    draft_cache = self._seed_cache(self.draft, token_ids)
+    target_cache = self._seed_cache(self.target, token_ids)
+
+    def window(x, start, length):
+      return keras.ops.slice(x, [0, start], [batch_size, length])
+
+    def cond(token_ids, draft_cache, target_cache, index, done, counts):
+      return keras.ops.logical_and(
+          index < max_length, keras.ops.logical_not(keras.ops.all(done))
+      )
+
+    def body(token_ids, draft_cache, target_cache, index, done, counts):
+      token_ids, draft_cache, target_cache, num_new, accepted = self._step(
+          token_ids, padding_mask, draft_cache, target_cache, index, done
+      )
+      num_new = keras.ops.minimum(num_new, max_length - index)
+
+      # Count positions not filled in by the prompt, for active rows only.
+      prompt_mask = window(padding_mask, index, k + 1)
+      positions = keras.ops.arange(k + 1)[None, :]
+      generated = keras.ops.logical_and(
+          positions < num_new, keras.ops.logical_not(prompt_mask)
+      )
+      proposed = keras.ops.logical_and(
+          positions[:, :k] < max_length - index,
+          keras.ops.logical_not(prompt_mask[:, :k]),
+      )
+      accepted_mask = keras.ops.logical_and(
+          proposed, positions[:, :k] < accepted[:, None]
+      )
+      active = keras.ops.cast(keras.ops.logical_not(done), "int32")[:, None]
+      counts = counts + keras.ops.stack(
+          [
+              keras.ops.sum(keras.ops.cast(proposed, "int32") * active),
+              keras.ops.sum(keras.ops.cast(accepted_mask, "int32") * active),
+              keras.ops.sum(keras.ops.cast(generated, "int32") * active),
+              num_new,
+              1,
+          ]
+      )
+
+      # Rows are done once they generate a stop token.
+      new_tokens = window(token_ids, index, k + 1)
+      is_stop = keras.ops.zeros_like(generated)
+      for stop_token_id in stop_token_ids:
+        is_stop = keras.ops.logical_or(is_stop, new_tokens == stop_token_id)
+      done = keras.ops.logical_or(
+          done, keras.ops.any(keras.ops.logical_and(is_stop, generated), axis=1)
+      )
+      return token_ids, draft_cache, target_cache, index + num_new, done, counts
+
+    # Start at the first index that has no user inputted id.
+    index = keras.ops.min(
+        keras.ops.sum(keras.ops.cast(padding_mask, "int32"), axis=1)
+    )
+    done = keras.ops.zeros([batch_size], dtype="bool")
+    counts = keras.ops.zeros([5], dtype="int32")
+    token_ids, _, _, _, _, counts = keras.ops.while_loop(
+        cond,
+        body,
+        (token_ids, draft_cache, target_cache, index, done, counts),
+    )
+    return token_ids, counts
+
+  def _compile(self, token_ids, padding_mask, stop_token_ids) -> None:
+    """Compiles decoding for the shape of the inputs, if not done yet."""
+    key = (tuple(token_ids.shape), stop_token_ids)
+    if key in self._compiled_keys:
+      return
+    self._compiled_keys.add(key)
+
+    # With the whole row marked as prompt, the loop body never runs, but the
+    # function is traced and compiled all the same.
+    logging.info("Compiling speculative decoding for shape %s", key[0])
+    start_time = time.monotonic()
+    self._generate_fn(
+        token_ids, keras.ops.ones_like(padding_mask), stop_token_ids
+    )
+    self.stats.compile_seconds += time.monotonic() - start_time
+
+  def _decode(
+      self,
+      token_ids: numpy.ndarray,
+      padding_mask: numpy.ndarray,
+      stop_token_ids: tuple[int, ...],
+  ) -> numpy.ndarray:
+    """Fills in `token_ids` after the prompt, returning the output mask."""
+    compiled = keras.backend.backend() == "tensorflow"
+    if self._generate_fn is None:
+      if compiled:
+        import tensorflow as tf
+
+        self._generate_fn = tf.function(self._generate_step, jit_compile=True)
+      else:
+        logging.warning(
+            "No compiled speculative decoding path for backend %s",
+            keras.backend.backend(),
+        )
+        self._generate_fn = self._generate_step
+
+    # Pad the inputs so that every step fits in, whatever its index.
+    max_length = token_ids.shape[1]
+    padding = ((0, 0), (0, self.num_draft_tokens + 1))
+    padded_ids = keras.ops.convert_to_tensor(numpy.pad(token_ids, padding))
+    padded_mask = keras.ops.convert_to_tensor(numpy.pad(padding_mask, padding))
+    stop_token_ids = tuple(stop_token_ids)
+    if compiled:
+      self._compile(padded_ids, padded_mask, stop_token_ids)
+    outputs, counts = self._generate_fn(
+        padded_ids, padded_mask, stop_token_ids
+    )
+    token_ids[:] = keras.ops.convert_to_numpy(outputs)[:, :max_length]
+
+    proposed, accepted, generated, positions, steps = (
+        keras.ops.convert_to_numpy(counts).tolist()
+    )
+    self.stats.proposed_tokens += proposed
+    self.stats.accepted_tokens += accepted
+    self.stats.generated_tokens += generated
+    self.stats.decoded_positions += positions
+    self.stats.target_steps += steps
+
+    # Mask out everything after the first generated stop token.
+    end_locations = numpy.isin(token_ids, stop_token_ids) & ~padding_mask
+    end_locations = end_locations.astype("int32")
+    overflow = numpy.cumsum(end_locations, axis=1) - end_locations
+    return overflow == 0
+
+  def generate(
+      self,
+      prompts: list[str],
+      max_length: int | None = None,
+      stop_token_ids: tuple[int, ...] | None = None,
+  ) -> list[str]:
+    """Generates completions for a batch of prompts, like `generate`."""
+    preprocessor = self.target.preprocessor
+    if stop_token_ids is None:
+      stop_token_ids = (preprocessor.tokenizer.end_token_id,)
+
+    start_time = time.monotonic()
+    compile_seconds = self.stats.compile_seconds
+    inputs = preprocessor.generate_preprocess(
+        prompts, sequence_length=max_length
+    )
+    token_ids = numpy.array(keras.ops.convert_to_numpy(inputs["token_ids"]))
+    padding_mask = keras.ops.convert_to_numpy(inputs["padding_mask"])
+    padding_mask = padding_mask.astype(bool)
+
+    output_mask = self._decode(token_ids, padding_mask, stop_token_ids)
+    outputs = preprocessor.generate_postprocess(
+        {"token_ids": token_ids, "padding_mask": output_mask}
+    )
+    # Compilation is reported separately, so it does not skew the throughput.
+    compile_seconds = self.stats.compile_seconds - compile_seconds
+    self.stats.elapsed_seconds += time.monotonic() - start_time - compile_seconds
+    logging.info("Speculative decoding: %s", self.stats)
+
+    outputs = keras.ops.convert_to_numpy(outputs)
+    return [x.decode("utf-8") if isinstance(x, bytes) else x for x in outputs]
@@ -1,5 +1,9 @@
+from typing import TYPE_CHECKING
+
 import keras
-import keras_nlp
+
+if TYPE_CHECKING:
+  import keras_nlp
 
 
 class TokenProbabilityLayer(keras.layers.Layer):
@@ -19,7 +23,7 @@ class TokenProbabilityLayer(keras.layers.Layer):
 
 
 def build_token_probability_model(
-    model: keras_nlp.models.CausalLM,
+    model: "keras_nlp.models.CausalLM",
     token_set: list[str],
 ) -> keras.Model:
   token_to_id = model.preprocessor.tokenizer.token_to_id
@@ -1,8 +1,10 @@
-import sys
+import itertools
+import os
+import tempfile
+from typing import Any
 
 from absl import logging
 import click
-import json5
 from tqdm import auto as tqdm
 
 from llm_comparator import comparison
@@ -10,8 +12,12 @@ from llm_comparator import types as llm_types
 from llm_comparator import llm_judge_runner
 from llm_comparator import model_helper
 from llm_comparator import rationale_bullet_generator
-from llm_comparator import rationale_cluster_generator
 from rgai_tools.common import model_loader
+from rgai_tools.common import record_reader
+from rgai_tools.common import speculative_decoding
+from rgai_tools.llm_comparator import config_writer
+from rgai_tools.llm_comparator import embedding
+from rgai_tools.llm_comparator import generation_planner
 from rgai_tools.llm_comparator import simple_server
 
 
@@ -29,7 +35,10 @@ def llm_comparator():
 @click.option(
     "--config-file",
     type=click.STRING,
-    help="Path to the saved LLM comparator config file.",
+    help=(
+        "Path or URL to the saved LLM comparator config file. Local files may "
+        "be gzip-compressed or a manifest of sharded outputs."
+    ),
 )
 @click.option(
     "--port",
@@ -69,6 +78,26 @@ def launch(
     default=512,
     help="Maximum number of tokens to generate.",
 )
+@click.option(
+    "--draft-model",
+    type=click.STRING,
+    help=(
+        "Preset (name) of a small model sharing the tokenizer of models A and "
+        "B, used to speed up their generation with speculative decoding."
+    ),
+)
+@click.option(
+    "--draft-token-count",
+    type=click.INT,
+    default=4,
+    help="Number of tokens proposed by the draft model at each step.",
+)
+@click.option(
+    "--generation-batch-size",
+    type=click.INT,
+    default=8,
+    help="Number of distinct prompts to generate outputs for at once.",
+)
 @click.option(
     "--model-judge",
     type=click.STRING,
@@ -85,12 +114,51 @@ def launch(
     type=click.STRING,
     help="Prompt template to use for the LLM judge model.",
 )
+@click.option(
+    "--embedding-model",
+    type=click.STRING,
+    help=(
+        "Preset (name) of a local model used to embed the judge rationales. "
+        "If none is provided, Vertex AI text embeddings are used."
+    ),
+)
 @click.option(
     "--output-file",
     type=click.STRING,
     help=(
         "Path to the saved LLM comparator config file. If none is provided, "
-        "the config will be saved as a temporary file and deleted on exit."
+        "the config will be saved as a temporary file and deleted on exit. "
+        "Paths ending with '.gz' are gzip-compressed."
+    ),
+)
+@click.option(
+    "--output-shard-size",
+    type=click.INT,
+    help=(
+        "Number of examples per output shard. If given, the output file is a "
+        "manifest listing JSONL shards written next to it, which can be served "
+        "with the `launch` command."
+    ),
+)
+@click.option(
+    "--input-file",
+    type=click.Path(exists=True, dir_okay=False),
+    help="JSON(L), CSV or Parquet file to read from instead of stdin.",
+)
+@click.option(
+    "--num-workers",
+    type=click.INT,
+    default=0,
+    help="Number of worker processes used to parse JSONL input.",
+)
+@click.option(
+    "--chunk-size",
+    type=click.INT,
+    default=1024,
+    help=(
+        "Number of records generated and written at a time when no LLM judge "
+        "is given, which bounds memory use. Repeated prompts are only "
+        "generated once within a chunk."
     ),
 )
 @click.option(
@@ -109,16 +177,29 @@ def compare(
     model_a: str,
     model_b: str,
     max_token_count: int,
+    draft_model: str | None,
+    draft_token_count: int,
+    generation_batch_size: int,
     model_judge: str,
     model_judge_prompt: str,
     model_judge_count: int,
+    embedding_model: str | None,
     output_file: str,
+    output_shard_size: int | None,
+    input_file: str | None,
+    num_workers: int,
+    chunk_size: int,
     port: int,
     serve: bool,
 ) -> None:
   models = [{"name": model_a}, {"name": model_b}]
   metadata = dict(source_path="rgai-tools", custom_fields_schema=[])
-  config = dict(models=models, metadata=metadata, examples=[])
+
+  # Without an output file, the config is only needed for serving.
+  temp_dir = None
+  if output_file is None:
+    temp_dir = tempfile.TemporaryDirectory()
+    output_file = os.path.join(temp_dir.name, "config.json")
 
   # Load the model judge.
   if model_judge:
@@ -130,8 +211,13 @@ def compare(
 
     # The embedding model can be any text embedder provided by Vertex AI. We default
     # to 'textembedding-gecko@003' but you can change this with the `model_name=`
-    # param
-    embedder = model_helper.VertexEmbeddingModelHelper()
+    # param. Alternatively, a local model can be used to embed fully offline.
+    if embedding_model:
+      embedder = embedding.GemmaEmbeddingModelHelper(
+          model_loader.get_gemma_model(embedding_model)
+      )
+    else:
+      embedder = model_helper.VertexEmbeddingModelHelper()
 
     # The `bulletizer` condenses the results provided by the judge into a set of
     # bullets to make them easier to understand and consume in the UI.
@@ -139,16 +225,12 @@ def compare(
 
     # The `clusterer` takes the bullets, embeds them, groups them into clusters
     # based on embedding similarity, and generates a label for those clusters.
-    clusterer = rationale_cluster_generator.RationaleClusterGenerator(
+    clusterer = embedding.VectorizedRationaleClusterGenerator(
         gen_model_helper=generator,
         emb_model_helper=embedder,
     )
 
-  # Pre-define variables for the LLM models that might be needed later.
-  llm_a: model_loader.IModel | None = None
-  llm_b: model_loader.IModel | None = None
-
-  # Read stdin for the user content.
+  # Read stdin for the user content, or the given input file.
   click.echo(
       """
 Expected format, in a single line:
@@ -161,79 +243,130 @@ Expected format, in a single line:
     'individual_rater_scores': [<list of individual rater scores, optional>],
     'radionale_list': [<list of individual rater rationale, optional>],
   }
+"""
+  )
+  if not input_file:
+    click.echo(
+        "Reading user content from stdin. You can pipe input from another "
+        "command or type it in the terminal followed by [CTRL + D]."
+    )
+
+  def report_error(error: record_reader.RecordError) -> None:
+    click.echo(
+        f"Skipping input line {error.line_number}: {error.content}. "
+        f"Error: {error.error}",
+        err=True,
+    )
 
-Reading user content from stdin. You can pipe input from another command or
-command or type it in the terminal followed by [CTRL + D]."""
+  records = record_reader.read_records(
+      input_file, num_workers=num_workers, on_error=report_error
   )
-  # NOTE: This will produce prompt outputs one record at a time, which is a
-  # very inefficient way to use the LLM models. In the future, batching should
-  # be implemented.
-  for line in tqdm.tqdm(sys.stdin.readlines(), desc="Processing inputs"):
-    line = line.strip()
-    if line:
-      try:
-        record = json5.loads(line)
-
-        # Produce the output for model A.
-        if "output_text_a" not in record:
-          if not model_a:
-            raise ValueError("Expected 'output_text_a' field in input when no model A is given.")
-          if not llm_a:
-            llm_a = model_loader.load_gemma_model(model_a)
-          record["output_text_a"] = llm_a.generate(
-              [record["input"]],
-              max_length=max_token_count,
-          )[0]
-
-        # Produce the output for model B.
-        if "output_text_b" not in record:
-          if not model_b:
-            raise ValueError("Expected 'output_text_b' field in input when no model B is given.")
-          if not llm_b:
-            llm_b = model_loader.load_gemma_model(model_b)
-          record["output_text_b"] = llm_b.generate(
-              [record["input"]],
-              max_length=max_token_count,
-          )[0]
-
-        # Produce the score from the LLM judge.
-        if "score" not in record:
-          if not model_judge:
-            raise ValueError("Expected 'score' field in input when no LLM judge is given.")
-
-          llm_judge_input = llm_types.LLMJudgeInput(
-              prompt=record["input"],
-              response_a=record["output_text_a"],
-              response_b=record["output_text_b"],
-          )
-          llm_judge_output = comparison.run(
-              inputs=[llm_judge_input],
-              judge=llm_judge,
-              bulletizer=bulletizer,
-              clusterer=clusterer,
-              model_names=(model_a, model_b),
-              judge_opts=dict(num_repeats=model_judge_count),
-          )
-          record = dict(record, **llm_judge_output["examples"][0])
-
-        # Append the record to the examples list.
-        config["examples"].append(record)
-      except Exception as exc:
-        click.echo(f"Failed to parse input line: {line}. Error: {exc}", err=True)
-        raise exc
-
-  # Save the config to the output file.
-  if output_file is not None:
-    with open(output_file, "w") as f:
-      logging.info("Saving LLM comparator config to %s", output_file)
-      json5.dump(config, f)
+
+  # Speculative decoders, one per target model, if a draft model is given.
+  decoders: dict[str, speculative_decoding.SpeculativeDecoder] = {}
+
+  def generate(model: str, prompts: list[str], max_length: int) -> list[str]:
+    # Models are shared, so the same preset is only loaded once.
+    llm = model_loader.get_gemma_model(model)
+    if not draft_model:
+      return llm.generate(prompts, max_length=max_length)
+
+    if model not in decoders:
+      decoders[model] = speculative_decoding.SpeculativeDecoder(
+          target=llm,
+          draft=model_loader.get_gemma_model(draft_model),
+          num_draft_tokens=draft_token_count,
+      )
+    return decoders[model].generate(prompts, max_length=max_length)
+
+  def generate_outputs(chunk: list[dict[str, Any]]) -> None:
+    # Plan the model outputs, so that each distinct prompt is only generated
+    # once per model even if it appears in multiple records of the chunk or
+    # both models are equal.
+    plan = generation_planner.GenerationPlan()
+    for record in chunk:
+      for field, model in (("output_text_a", model_a), ("output_text_b", model_b)):
+        if field not in record:
+          if not model:
+            raise ValueError(f"Expected '{field}' field in input when no model is given.")
+          if "input" not in record:
+            raise ValueError(f"Expected 'input' field in input when no '{field}' is given.")
+          plan.add(record, field, model, record["input"], max_token_count)
+    plan.run(generate, batch_size=generation_batch_size)
+
+  def judge_outputs(
+      all_records: list[dict[str, Any]],
+  ) -> list[dict[str, Any]] | None:
+    # Produce the scores from the LLM judge. All records are judged at once, so
+    # their rationales are bulletized and clustered together.
+    unscored = [
+        i for i, record in enumerate(all_records) if "score" not in record
+    ]
+    if not unscored:
+      return None
+
+    llm_judge_inputs = [
+        llm_types.LLMJudgeInput(
+            prompt=all_records[i]["input"],
+            response_a=all_records[i]["output_text_a"],
+            response_b=all_records[i]["output_text_b"],
+        )
+        for i in unscored
+    ]
+    llm_judge_output = comparison.run(
+        inputs=llm_judge_inputs,
+        judge=llm_judge,
+        bulletizer=bulletizer,
+        clusterer=clusterer,
+        model_names=(model_a, model_b),
+        judge_opts=dict(num_repeats=model_judge_count),
+    )
+    for i, example in zip(unscored, llm_judge_output["examples"]):
+      all_records[i] = dict(all_records[i], **example)
+    return llm_judge_output["rationale_clusters"]
+
+  # Rationales are clustered across all records, so with an LLM judge every
+  # record is held in memory until the end. Otherwise, records are generated
+  # and written a chunk at a time.
+  rationale_clusters = None
+  if model_judge:
+    records = list(records)
+    generate_outputs(records)
+    rationale_clusters = judge_outputs(records)
+    chunks = iter([records])
+  else:
+    chunks = iter(lambda: list(itertools.islice(records, chunk_size)), [])
+
+  writer = config_writer.ConfigWriter(
+      output_file,
+      models=models,
+      metadata=metadata,
+      shard_size=output_shard_size,
+      rationale_clusters=rationale_clusters,
+  )
+  logging.info("Saving LLM comparator config to %s", output_file)
+  with writer:
+    for chunk in chunks:
+      if not model_judge:
+        generate_outputs(chunk)
+        if any("score" not in record for record in chunk):
+          raise ValueError("Expected 'score' field in input when no LLM judge is given.")
+      for record in tqdm.tqdm(chunk, desc="Writing outputs"):
+        # Stream the record to the output file.
+        writer.write(record)
+
+  for model, decoder in decoders.items():
+    click.echo(f"Speculative decoding for {model}: {decoder.stats}", err=True)
 
   if serve:
     simple_server.serve_llmc(
-        config_data=config,
+        config_file=output_file,
         port=port,
     )
 
+  if temp_dir is not None:
+    temp_dir.cleanup()
+
 
 if __name__ == "__main__":
   logging.set_verbosity(logging.INFO)
@@ -0,0 +1,158 @@
+import gzip
+import json
+import math
+import os
+from typing import Any, BinaryIO, Iterator
+
+from absl import logging
+
+try:
+  import orjson
+except ImportError:
+  orjson = None
+
+# Sharded configs are written as a small manifest whose first key is this one,
+# which lets readers detect them without parsing the whole file.
+SHARDS_KEY = "shards"
+MANIFEST_PREFIX = b'{"' + SHARDS_KEY.encode("utf-8") + b'":'
+
+
+def _replace_non_finite(obj: Any) -> Any:
+  """Replaces NaN and infinite floats with None, like orjson does."""
+  if isinstance(obj, float) and not math.isfinite(obj):
+    return None
+  if isinstance(obj, dict):
+    return {k: _replace_non_finite(v) for k, v in obj.items()}
+  if isinstance(obj, (list, tuple)):
+    return [_replace_non_finite(v) for v in obj]
+  return obj
+
+
+def dumps(obj: Any) -> bytes:
+  """Serializes an object as strict, compact JSON."""
+  if orjson is not None:
+    return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY)
+  try:
+    content = json.dumps(obj, separators=(",", ":"), allow_nan=False)
+  except ValueError:
+    # Only walk the object when it has non-finite numbers.
+    content = json.dumps(
+        _replace_non_finite(obj), separators=(",", ":"), allow_nan=False
+    )
+  return content.encode("utf-8")
+
+
+def open_file(path: str, mode: str = "rb") -> BinaryIO:
+  """Opens a file, transparently (de)compressing it if it ends with `.gz`."""
+  if path.endswith(".gz"):
+    return gzip.open(path, mode, compresslevel=5)
+  return open(path, mode)
+
+
+def is_manifest(path: str) -> bool:
+  """Returns whether the file at `path` is a sharded config manifest."""
+  with open_file(path) as f:
+    return f.read(len(MANIFEST_PREFIX)) == MANIFEST_PREFIX
+
+
+def iter_shard_examples(path: str) -> Iterator[bytes]:
+  """Yields the serialized examples in a shard, one per line."""
+  with open_file(path) as f:
+    for line in f:
+      line = line.strip()
+      if line:
+        yield line
+
+
+class ConfigWriter:
+  """Streams an LLM Comparator config to disk one example at a time.
+
+  Without sharding, `path` is a single strict-JSON config loadable by the UI.
+  With `shard_size`, examples are written as JSONL shards next to `path` and
+  `path` holds a manifest listing them, which `simple_server` can assemble on
+  the fly. Paths ending with `.gz` are gzip-compressed, including shards.
+  """
+
+  def __init__(
+      self,
+      path: str,
+      models: list[dict[str, Any]],
+      metadata: dict[str, Any],
+      shard_size: int | None = None,
+      rationale_clusters: list[dict[str, Any]] | None = None,
+  ):
+    if shard_size is not None and shard_size < 1:
+      raise ValueError("shard_size must be a positive integer")
+    self.path = path
+    self.models = models
+    self.metadata = metadata
+    self.shard_size = shard_size
+    self.rationale_clusters = rationale_clusters
+    self.example_count = 0
+    self.shards: list[str] = []
+    self._file: BinaryIO | None = None
+    self._shard_count = 0
+
+  def __enter__(self) -> "ConfigWriter":
+    if self.shard_size is None:
+      self._file = open_file(self.path, "wb")
+      self._file.write(b'{"models":' + dumps(self.models))
+      self._file.write(b',"metadata":' + dumps(self.metadata))
+      if self.rationale_clusters is not None:
+        clusters = dumps(self.rationale_clusters)
+        self._file.write(b',"rationale_clusters":' + clusters)
+      self._file.write(b',"examples":[')
+    return self
+
+  def __exit__(self, *exc_info) -> None:
+    self.close()
+
+  def _shard_path(self, index: int) -> str:
+    root, ext = self.path, ""
+    if root.endswith(".gz"):
+      root, ext = root[: -len(".gz")], ".gz"
+    root = os.path.splitext(root)[0]
+    return f"{root}-{index:05d}.jsonl{ext}"
+
+  def _next_shard(self) -> None:
+    if self._file is not None:
+      self._file.close()
+    shard_path = self._shard_path(len(self.shards))
+    self.shards.append(os.path.basename(shard_path))
+    self._file = open_file(shard_path, "wb")
+    self._shard_count = 0
+
+  def write(self, example: dict[str, Any]) -> None:
+    """Serializes and writes a single example."""
+    if self.shard_size is None:
+      if self._file is None:
+        raise ValueError("ConfigWriter must be used as a context manager")
+      self._file.write(b",\n" if self.example_count else b"\n")
+    else:
+      if self._file is None or self._shard_count >= self.shard_size:
+        self._next_shard()
+      self._shard_count += 1
+    self._file.write(dumps(example))
+    if self.shard_size is not None:
+      self._file.write(b"\n")
+    self.example_count += 1
+
+  def close(self) -> None:
+    """Finalizes the config, writing the manifest for sharded outputs."""
+    if self._file is not None:
+      if self.shard_size is None:
+        self._file.write(b"\n]}")
+      self._file.close()
+      self._file = None
+
+    if self.shard_size is not None:
+      manifest = {
+          SHARDS_KEY: self.shards,
+          "models": self.models,
+          "metadata": self.metadata,
+      }
+      if self.rationale_clusters is not None:
+        manifest["rationale_clusters"] = self.rationale_clusters
+      with open_file(self.path, "wb") as f:
+        f.write(dumps(manifest))
+    logging.info("Wrote %d examples to %s", self.example_count, self.path)
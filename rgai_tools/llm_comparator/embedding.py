@@ -0,0 +1,128 @@
+import hashlib
+from typing import Mapping, Sequence, TYPE_CHECKING
+
+import keras
+from llm_comparator import model_helper
+from llm_comparator import rationale_cluster_generator
+import numpy
+
+from rgai_tools.common import scoring
+
+if TYPE_CHECKING:
+  import keras_nlp
+
+
+class MaskedMeanPoolingLayer(keras.layers.Layer):
+  """Layer that averages hidden states over the unmasked tokens."""
+
+  def call(self, hidden_states, padding_mask):
+    mask = keras.ops.cast(padding_mask, hidden_states.dtype)[:, :, None]
+    total = keras.ops.sum(hidden_states * mask, axis=1)
+    count = keras.ops.maximum(keras.ops.sum(mask, axis=1), 1.0)
+    return keras.ops.cast(total / count, "float32")
+
+
+def build_embedding_model(model: "keras_nlp.models.CausalLM") -> keras.Model:
+  """Builds a model returning mean-pooled final hidden states of a backbone."""
+  backbone = model.backbone
+  inputs = backbone.input
+  x = backbone(inputs)
+  x = MaskedMeanPoolingLayer()(x, inputs["padding_mask"])
+  return keras.Model(inputs=inputs, outputs=x)
+
+
+class GemmaEmbeddingModelHelper(model_helper.EmbeddingModelHelper):
+  """Local text embedder using the hidden states of a Gemma model.
+
+  Texts are embedded in large padded batches through a compiled forward pass,
+  and embeddings are cached by text hash so repeated texts are free.
+  """
+
+  def __init__(
+      self,
+      model: "keras_nlp.models.CausalLM",
+      batch_size: int = 64,
+  ):
+    self.model = model
+    self.batch_size = batch_size
+    self.embedding_model = build_embedding_model(model)
+    self.embedding_fn = scoring.ScoringFunction(
+        self.embedding_model,
+        max_sequence_length=model.preprocessor.sequence_length,
+        batch_sizes=(1, batch_size),
+    )
+    self._cache: dict[bytes, numpy.ndarray] = {}
+
+  def _key(self, text: str) -> bytes:
+    return hashlib.sha1(text.encode("utf-8")).digest()
+
+  def embed(self, text: str) -> Sequence[float]:
+    return self.embed_batch([text])[0]
+
+  def embed_batch(self, texts: Sequence[str]) -> Sequence[Sequence[float]]:
+    missing = {}
+    for text in texts:
+      key = self._key(text)
+      if key not in self._cache:
+        missing[key] = text
+
+    if missing:
+      # Sort by length so each batch is padded to a similar length bucket.
+      keys = sorted(missing, key=lambda k: len(missing[k]))
+      for start in range(0, len(keys), self.batch_size):
+        batch_keys = keys[start : start + self.batch_size]
+        inputs = self.model.preprocessor.generate_preprocess(
+            [missing[key] for key in batch_keys]
+        )
+        embeddings = self.embedding_fn(inputs)
+        self._cache.update(zip(batch_keys, embeddings))
+
+    return [self._cache[self._key(text)] for text in texts]
+
+
+class VectorizedRationaleClusterGenerator(
+    rationale_cluster_generator.RationaleClusterGenerator
+):
+  """Rationale cluster generator using batched embeddings and NumPy.
+
+  All rationales and paraphrases are embedded in a single `embed_batch` call,
+  and similarities to every cluster are computed with one matrix product.
+  """
+
+  def _embed_rationales(
+      self,
+      paraphrased_rationales: Mapping[str, Sequence[str]],
+  ) -> dict[str, numpy.ndarray]:
+    rationales = list(paraphrased_rationales)
+    if not rationales:
+      return {}
+
+    texts, offsets = [], []
+    for rationale in rationales:
+      offsets.append(len(texts))
+      texts.append(rationale)
+      texts.extend(paraphrased_rationales[rationale])
+
+    # Average the embeddings of each rationale and its paraphrases.
+    embeddings = numpy.asarray(self._embedder.embed_batch(texts))
+    counts = numpy.diff(offsets + [len(texts)])[:, None]
+    means = numpy.add.reduceat(embeddings, offsets, axis=0) / counts
+    return dict(zip(rationales, means))
+
+  def _compute_similarities_to_clusters(
+      self,
+      embeddings_for_rationales: Mapping[str, Sequence[float]],
+      embeddings_for_cluster_titles: Sequence[Sequence[float]],
+  ) -> Mapping[str, Sequence[float]]:
+    if not embeddings_for_rationales or not len(embeddings_for_cluster_titles):
+      return {rationale: [] for rationale in embeddings_for_rationales}
+
+    def normalize(matrix):
+      matrix = numpy.asarray(matrix, dtype="float32")
+      norms = numpy.linalg.norm(matrix, axis=1, keepdims=True)
+      return matrix / numpy.maximum(norms, 1e-12)
+
+    rationales = normalize(list(embeddings_for_rationales.values()))
+    clusters = normalize(embeddings_for_cluster_titles)
+    similarities = (rationales @ clusters.T).tolist()
+    return dict(zip(embeddings_for_rationales, similarities))
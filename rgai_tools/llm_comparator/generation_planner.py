@@ -0,0 +1,72 @@
+from typing import Any, Callable, NamedTuple
+
+from absl import logging
+from tqdm import auto as tqdm
+
+
+class GenerationKey(NamedTuple):
+  """A distinct generation request."""
+
+  model: str
+  prompt: str
+  max_length: int
+
+
+class GenerationPlan:
+  """Deduplicates generation requests across records.
+
+  Each distinct (model, prompt, max_length) is generated once, and the output is
+  fanned back out to every record field that asked for it.
+  """
+
+  def __init__(self):
+    self.targets: dict[GenerationKey, list[tuple[dict[str, Any], str]]] = {}
+    self.request_count = 0
+
+  def add(
+      self,
+      record: dict[str, Any],
+      field: str,
+      model: str,
+      prompt: str,
+      max_length: int,
+  ) -> None:
+    """Requests `record[field]` to be filled with the model's output."""
+    key = GenerationKey(model, prompt, max_length)
+    self.targets.setdefault(key, []).append((record, field))
+    self.request_count += 1
+
+  def run(
+      self,
+      generate: Callable[[str, list[str], int], list[str]],
+      batch_size: int = 1,
+  ) -> None:
+    """Runs the distinct generations in batches and fills in the records.
+
+    Args:
+      generate: Function taking a model name, a batch of prompts and the
+        maximum length, and returning one output per prompt.
+      batch_size: Maximum number of prompts per call to `generate`.
+    """
+    logging.info(
+        "Generating %d distinct outputs for %d requests",
+        len(self.targets),
+        self.request_count,
+    )
+
+    # Group by model and length so each batch goes through a single call.
+    groups: dict[tuple[str, int], list[str]] = {}
+    for key in self.targets:
+      groups.setdefault((key.model, key.max_length), []).append(key.prompt)
+
+    progress = tqdm.tqdm(total=len(self.targets), desc="Generating outputs")
+    for (model, max_length), prompts in groups.items():
+      for start in range(0, len(prompts), batch_size):
+        batch = prompts[start : start + batch_size]
+        outputs = generate(model, batch, max_length)
+        for prompt, output in zip(batch, outputs):
+          key = GenerationKey(model, prompt, max_length)
+          for record, field in self.targets[key]:
+            record[field] = output
+        progress.update(len(batch))
+    progress.close()
@@ -1,75 +1,346 @@
+import gzip
+import hashlib
 import json
+import mmap
 import os
-import tempfile
-import shutil
-from typing import Any
+import socketserver
+import threading
+import zlib
+from typing import Any, Iterator
+from wsgiref import simple_server as wsgiref_server
 
 from absl import logging
 import bottle
+import json5
 import llm_comparator
 
+from rgai_tools.llm_comparator import config_writer
+
+try:
+  import brotli
+except ImportError:
+  brotli = None
+
+
+_CHUNK_SIZE = 1 << 20
+
+
+class _ThreadingWSGIServer(
+    socketserver.ThreadingMixIn,
+    wsgiref_server.WSGIServer,
+):
+  """WSGI server that handles each request in its own thread."""
+
+  daemon_threads = True
+
+
+class ConfigPayload:
+  """In-memory (or memory-mapped) LLM Comparator config served over HTTP.
+
+  Compressed representations are computed lazily on first request and cached,
+  so they are only paid for once per encoding.
+  """
+
+  def __init__(
+      self,
+      buffer: bytes | mmap.mmap,
+      etag: str,
+      content_encoding: str = "identity",
+  ):
+    self.buffer = buffer
+    self.etag = etag
+    self.content_encoding = content_encoding
+    self._encoded: dict[str, bytes] = {}
+    self._lock = threading.Lock()
+
+  @classmethod
+  def from_data(cls, config_data: dict[str, Any] | str) -> "ConfigPayload":
+    """Builds a payload from a config dict or a JSON(5) string."""
+    if isinstance(config_data, str):
+      try:
+        json.loads(config_data)
+        buffer = config_data.encode("utf-8")
+      except ValueError:
+        buffer = json.dumps(json5.loads(config_data)).encode("utf-8")
+    else:
+      buffer = json.dumps(config_data).encode("utf-8")
+    return cls(buffer, etag=hashlib.sha1(buffer).hexdigest())
+
+  @classmethod
+  def from_file(cls, path: str) -> "ConfigPayload":
+    """Memory-maps a local config file without reading it into memory.
+
+    Files ending with `.gz` are served as-is to clients that accept gzip.
+    """
+    stat = os.stat(path)
+    etag = f"{stat.st_size:x}-{stat.st_mtime_ns:x}"
+    encoding = "gzip" if path.endswith(".gz") else "identity"
+    with open(path, "rb") as f:
+      if stat.st_size == 0:
+        return cls(b"", etag=etag)
+      # The mapping stays valid after the file object is closed.
+      buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+      return cls(buffer, etag=etag, content_encoding=encoding)
+
+  def encoded(self, encoding: str) -> bytes | mmap.mmap:
+    """Returns the payload in the given content encoding."""
+    if encoding == self.content_encoding:
+      return self.buffer
+
+    with self._lock:
+      if encoding not in self._encoded:
+        logging.info("Encoding config payload with %s", encoding)
+        if encoding == "identity":
+          self._encoded[encoding] = gzip.decompress(self.buffer)
+        else:
+          identity = self.buffer
+          if self.content_encoding != "identity":
+            identity = gzip.decompress(self.buffer)
+          self._encoded[encoding] = _compress(identity, encoding)
+      return self._encoded[encoding]
+
+
+class ShardedConfigPayload:
+  """Sharded LLM Comparator config assembled into a single JSON on the fly.
+
+  Only one example is held in memory at a time, so configs larger than the
+  available memory can still be served to the UI.
+  """
+
+  content_encoding = "identity"
+
+  def __init__(self, manifest_path: str):
+    with config_writer.open_file(manifest_path) as f:
+      manifest = json.load(f)
+    root = os.path.dirname(manifest_path)
+    self.shard_paths = [
+        os.path.join(root, shard) for shard in manifest["shards"]
+    ]
+    self.header = b'{"models":' + config_writer.dumps(manifest["models"])
+    self.header += b',"metadata":' + config_writer.dumps(manifest["metadata"])
+    if "rationale_clusters" in manifest:
+      clusters = config_writer.dumps(manifest["rationale_clusters"])
+      self.header += b',"rationale_clusters":' + clusters
+    self.header += b',"examples":['
+
+    stats = [os.stat(path) for path in [manifest_path, *self.shard_paths]]
+    fingerprint = ",".join(f"{s.st_size:x}-{s.st_mtime_ns:x}" for s in stats)
+    self.etag = hashlib.sha1(fingerprint.encode("utf-8")).hexdigest()
+
+  def _iter_identity(self) -> Iterator[bytes]:
+    chunk = [self.header]
+    chunk_size = len(self.header)
+    separator = b"\n"
+    for shard_path in self.shard_paths:
+      for example in config_writer.iter_shard_examples(shard_path):
+        chunk.append(separator)
+        chunk.append(example)
+        chunk_size += len(example) + 1
+        separator = b",\n"
+        if chunk_size >= _CHUNK_SIZE:
+          yield b"".join(chunk)
+          chunk, chunk_size = [], 0
+    chunk.append(b"\n]}")
+    yield b"".join(chunk)
+
+  def iter_encoded(self, encoding: str) -> Iterator[bytes]:
+    """Yields the assembled config in the given content encoding."""
+    if encoding == "identity":
+      yield from self._iter_identity()
+      return
+
+    if encoding == "br":
+      compressor = brotli.Compressor(quality=5)
+      compress, flush = compressor.process, compressor.finish
+    elif encoding == "gzip":
+      compressor = zlib.compressobj(5, zlib.DEFLATED, 31)
+      compress, flush = compressor.compress, compressor.flush
+    else:
+      raise ValueError(f"Unsupported encoding: {encoding}")
+
+    for chunk in self._iter_identity():
+      data = compress(chunk)
+      if data:
+        yield data
+    yield flush()
+
+
+def _compress(data: bytes, encoding: str) -> bytes:
+  if encoding == "br":
+    return brotli.compress(data, quality=5)
+  if encoding == "gzip":
+    return gzip.compress(data, compresslevel=5)
+  raise ValueError(f"Unsupported encoding: {encoding}")
+
+
+def load_config(path: str) -> ConfigPayload | ShardedConfigPayload:
+  """Loads a local config file, detecting sharded config manifests."""
+  if config_writer.is_manifest(path):
+    logging.info("Streaming sharded config from %s", path)
+    return ShardedConfigPayload(path)
+  logging.info("Memory-mapping config file %s", path)
+  return ConfigPayload.from_file(path)
+
+
+def _select_encoding(accept_encoding: str, preferred: str) -> str:
+  accepted = {
+      token.split(";")[0].strip().lower()
+      for token in accept_encoding.split(",")
+  }
+  if preferred in accepted:
+    return preferred
+  if brotli is not None and "br" in accepted:
+    return "br"
+  if "gzip" in accepted:
+    return "gzip"
+  return "identity"
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+  """Returns whether an If-None-Match header matches an ETag, weakly."""
+  tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+  return "*" in tags or etag in tags
+
+
+def _iter_chunks(body: bytes | mmap.mmap, start: int, end: int):
+  """Yields the requested byte range without copying the whole body."""
+  view = memoryview(body)
+  for offset in range(start, end, _CHUNK_SIZE):
+    yield bytes(view[offset : min(offset + _CHUNK_SIZE, end)])
+
+
+def _serve_payload(
+    payload: ConfigPayload | ShardedConfigPayload,
+) -> bottle.HTTPResponse:
+  """Serves a config payload with ETag caching, compression and ranges."""
+  accept_encoding = bottle.request.headers.get("Accept-Encoding", "")
+  encoding = _select_encoding(accept_encoding, payload.content_encoding)
+
+  # Each content encoding is a different representation, with its own ETag.
+  etag = f'"{payload.etag}-{encoding}"'
+  headers = {
+      "ETag": etag,
+      "Cache-Control": "no-cache",
+      "Accept-Ranges": "bytes",
+      "Content-Type": "application/json",
+      "Vary": "Accept-Encoding",
+  }
+  if _etag_matches(bottle.request.headers.get("If-None-Match", ""), etag):
+    return bottle.HTTPResponse(status=304, **headers)
+
+  if encoding != "identity":
+    headers["Content-Encoding"] = encoding
+
+  # Sharded payloads are streamed, so their length is not known up front.
+  if isinstance(payload, ShardedConfigPayload):
+    headers["Accept-Ranges"] = "none"
+    return bottle.HTTPResponse(payload.iter_encoded(encoding), **headers)
+
+  body = payload.encoded(encoding)
+
+  # Ranges apply to the selected representation, as per RFC 9110.
+  range_header = bottle.request.headers.get("Range")
+  if range_header:
+    ranges = list(bottle.parse_range_header(range_header, len(body)))
+    if not ranges:
+      headers["Content-Range"] = f"bytes */{len(body)}"
+      return bottle.HTTPResponse(status=416, **headers)
+    start, end = ranges[0]
+    headers["Content-Range"] = f"bytes {start}-{end - 1}/{len(body)}"
+    headers["Content-Length"] = str(end - start)
+    body = _iter_chunks(body, start, end)
+    return bottle.HTTPResponse(body, status=206, **headers)
+
+  headers["Content-Length"] = str(len(body))
+  return bottle.HTTPResponse(_iter_chunks(body, 0, len(body)), **headers)
+
+
+def _build_app(
+    directory: str,
+    config: ConfigPayload | ShardedConfigPayload | None = None,
+) -> bottle.Bottle:
+  app = bottle.Bottle()
+
+  if config is not None:
+
+    @app.route("/config.json")
+    def serve_config():
+      return _serve_payload(config)
+
+  @app.route("/")
+  def serve_index():
+    return bottle.static_file("index.html", root=directory)
+
+  @app.route("/<filepath:path>")
+  def serve_static(filepath: str):
+    return bottle.static_file(filepath, root=directory)
+
+  return app
+
 
 def static_server(
     directory: str,
     port: int = 8080,
     load_message: str | None = None,
+    config: ConfigPayload | ShardedConfigPayload | None = None,
 ) -> None:
-  """Starts a simple server to serve static files from the specified directory.
+  """Starts a threaded server to serve static files from a directory.
 
   Args:
     directory: The directory to serve static files from.
     port: The port to serve the files on.
     load_message: The message to display when the server is started.
+    config: Optional config payload to serve at `/config.json`.
 
   Returns:
     None
   """
-
-  @bottle.route("/")
-  def serve_index():
-    return bottle.static_file("index.html", root=directory)
-
-  @bottle.route("/<filepath:path>")
-  def serve_static(filepath: str):
-    return bottle.static_file(filepath, root=directory)
-
+  app = _build_app(directory, config=config)
   print(load_message or f"Serving {directory} at http://localhost:{port}")
-  bottle.run(host="localhost", port=port, quiet=True)
+  bottle.run(
+      app,
+      host="localhost",
+      port=port,
+      quiet=True,
+      server=bottle.WSGIRefServer,
+      server_class=_ThreadingWSGIServer,
+  )
 
 
 def serve_llmc(
     *,
     config_file: str | None = None,
-    config_data: dict[str, Any] | None = None,
+    config_data: dict[str, Any] | str | None = None,
     port: int = 8080,
 ) -> None:
   if (not config_data and not config_file) or (config_file and config_data):
     raise ValueError("Either config_file or config_data must be provided")
 
-  # Get the website root directory.
+  # Static assets are served directly from the installed package.
   www_root = os.path.join(llm_comparator.__path__[0], "data")
 
   # Determine the base URL for the server.
   base_url = f"http://localhost:{port}"
 
-  # Create a temporary folder, and serve files from there..
-  with tempfile.TemporaryDirectory() as temp_dir:
-    logging.info(f"Creating temporary directory at {temp_dir}")
-
-    # Copy all of the static contents.
-    shutil.copytree(www_root, temp_dir, dirs_exist_ok=True)
-
-    # Write the config file to the temporary directory, if given as data.
-    if config_data:
-      with open(os.path.join(temp_dir, "config.json"), "w") as f:
-        json.dump(config_data, f)
+  # Local configs are served from memory; remote ones are passed to the UI.
+  config = None
+  if config_data:
+    config = ConfigPayload.from_data(config_data)
+  elif os.path.isfile(config_file):
+    config = load_config(config_file)
 
-      # The UI expects a URL, so we need to make the path relative.
-      config_file = f"{base_url}/config.json"
+  # The UI expects a URL, so we need to make the path relative.
+  if config is not None:
+    config_file = f"{base_url}/config.json"
 
-    # Write a message to the terminal so users can click it.
-    query_string = f"?results_path={config_file}"
-    load_msg = f"Serving the LLM Comparator: {base_url}/{query_string}"
+  # Write a message to the terminal so users can click it.
+  query_string = f"?results_path={config_file}"
+  load_msg = f"Serving the LLM Comparator: {base_url}/{query_string}"
 
-    # Instantiate the server.
-    static_server(directory=temp_dir, port=port, load_message=load_msg)
+  # Instantiate the server.
+  static_server(
+      directory=www_root,
+      port=port,
+      load_message=load_msg,
+      config=config,
+  )
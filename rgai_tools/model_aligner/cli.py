@@ -1,11 +1,18 @@
 import os
+from typing import Any
 
 import click
 import json5
 
+from model_alignment import alignable_model_calls
 from model_alignment import model_helper
 from model_alignment import single_run
 
+from rgai_tools.common import model_loader
+from rgai_tools.common import record_reader
+from rgai_tools.model_aligner import local_model
+from rgai_tools.model_aligner import validation
+
 
 @click.group()
 def model_aligner():
@@ -39,6 +46,69 @@ def print_model_response(
   print("\n\n")
 
 
+def load_prompt_model(
+    gemini_key: str | None,
+    model_preset: str | None,
+    max_sequence_length: int,
+) -> model_helper.ModelHelper:
+  if model_preset:
+    # The model stays loaded for the whole session.
+    llm = model_loader.get_gemma_model(
+        model_preset,
+        max_sequence_length=max_sequence_length,
+        stream_weights=True,
+    )
+    return local_model.GemmaModelHelper(llm)
+
+  if not gemini_key:
+    raise ValueError(
+        "GEMINI_KEY environment variable must be set, or a local model preset "
+        "given with --model-preset"
+    )
+  return model_helper.GeminiModelHelper(api_key=gemini_key)
+
+
+def read_inputs(path: str) -> list[dict[str, Any]]:
+  def report_error(error: record_reader.RecordError) -> None:
+    click.echo(
+        f"Skipping input line {error.line_number}: {error.content}. "
+        f"Error: {error.error}",
+        err=True,
+    )
+
+  return list(record_reader.read_records(path, on_error=report_error))
+
+
+def default_validation_output(inputs_file: str) -> str:
+  return os.path.splitext(inputs_file)[0] + ".validation.jsonl"
+
+
+def run_validation(
+    model: model_helper.ModelHelper,
+    description: str,
+    inputs: list[dict[str, Any]],
+    output_file: str,
+    previous_results: list[validation.ValidationResult],
+    **validate_opts,
+) -> list[validation.ValidationResult]:
+  """Validates a description against all inputs, writing results and a diff."""
+  results = validation.validate(model, description, inputs, **validate_opts)
+  changed_count = validation.write_results(
+      output_file, results, previous_results
+  )
+  diff_file = os.path.splitext(output_file)[0] + ".diff"
+  with open(diff_file, "w") as f:
+    f.write(validation.diff_results(previous_results, results))
+
+  error_count = sum(result.error is not None for result in results)
+  print(
+      f"\nValidated {len(results)} inputs ({error_count} errors, "
+      f"{changed_count} changed responses). Results written to {output_file}, "
+      f"diff against the previous responses to {diff_file}.\n"
+  )
+  return results
+
+
 @model_aligner.command()
 @click.option(
     "--gemini-key",
@@ -46,19 +116,83 @@ def print_model_response(
     default=os.getenv("GEMINI_KEY"),
     help="Comma-separated list of labels for the classifier.",
 )
-def align_prompt(*, gemini_key: str) -> None:
-  if not gemini_key:
-    raise ValueError("GEMINI_KEY environment variable must be set")
+@click.option(
+    "--model-preset",
+    type=click.STRING,
+    help="Preset (name) of a local Gemma model to use instead of Gemini.",
+)
+@click.option(
+    "--max-sequence-length",
+    type=click.INT,
+    default=1024,
+    help="Maximum sequence length (prompt and response) for the local model.",
+)
+@click.option(
+    "--inputs",
+    "inputs_file",
+    type=click.Path(exists=True, dir_okay=False),
+    help="JSON(L), CSV or Parquet file of input instances to validate the prompt "
+    "against after every update.",
+)
+@click.option(
+    "--validation-output",
+    type=click.Path(dir_okay=False),
+    help="JSONL file to write validation results to. Defaults to the inputs "
+    "file name with a .validation.jsonl extension.",
+)
+@click.option(
+    "--max-concurrency",
+    type=click.INT,
+    default=4,
+    help="Maximum number of concurrent model calls when validating.",
+)
+def align_prompt(
+    *,
+    gemini_key: str,
+    model_preset: str | None,
+    max_sequence_length: int,
+    inputs_file: str | None,
+    validation_output: str | None,
+    max_concurrency: int,
+) -> None:
+  prompt_model = load_prompt_model(
+      gemini_key, model_preset, max_sequence_length
+  )
+  inputs = read_inputs(inputs_file) if inputs_file else []
+  if inputs_file:
+    validation_output = validation_output or default_validation_output(
+        inputs_file
+    )
 
   context = ""
   input_prompt = "Enter the model prompt with any {variable} in curly braces: "
   while not context:
     context = input(input_prompt).strip()
 
-  gemini_model = model_helper.GeminiModelHelper(api_key=gemini_key)
-  aligner = single_run.AlignableSingleRun(gemini_model)
+  aligner = single_run.AlignableSingleRun(prompt_model)
   aligner.set_model_description(context)
 
+  # Responses are cached across updates, so only inputs whose prompt changed
+  # are sent to the model again.
+  cache = validation.ResponseCache()
+  validation_results = []
+
+  def validate_inputs() -> None:
+    nonlocal validation_results
+    # The principles are already folded into the model description, which is
+    # what `send_input` sends to the model, so the same prompt is validated.
+    if inputs:
+      validation_results = run_validation(
+          prompt_model,
+          aligner.get_model_description(),
+          inputs,
+          validation_output,
+          validation_results,
+          max_concurrency=max_concurrency,
+          cache=cache,
+      )
+
+  validate_inputs()
   input_instance = prompt_for_inputs()
   print_model_response(aligner, input_instance)
 
@@ -87,6 +221,7 @@ def align_prompt(*, gemini_key: str) -> None:
       print(f"\nPrinciples generated from critique: {principles}")
       aligner.update_model_description_from_principles()
       print_model_response(aligner, input_instance)
+      validate_inputs()
 
     elif selection == "2":
       praise = input("Enter praise for the response: ")
@@ -94,6 +229,7 @@ def align_prompt(*, gemini_key: str) -> None:
       print(f"\nPrinciples generated from praise: {principles}")
       aligner.update_model_description_from_principles()
       print_model_response(aligner, input_instance)
+      validate_inputs()
 
     elif selection == "3":
       critiques = aligner.generate_critiques()
@@ -114,5 +250,110 @@ def align_prompt(*, gemini_key: str) -> None:
   print_indented(aligner.get_model_description_with_principles() + "\n", indent=1)
 
 
+@model_aligner.command()
+@click.option(
+    "--gemini-key",
+    type=click.STRING,
+    default=os.getenv("GEMINI_KEY"),
+    help="Gemini API key, used if no local model preset is given.",
+)
+@click.option(
+    "--model-preset",
+    type=click.STRING,
+    help="Preset (name) of a local Gemma model to use instead of Gemini.",
+)
+@click.option(
+    "--max-sequence-length",
+    type=click.INT,
+    default=1024,
+    help="Maximum sequence length (prompt and response) for the local model.",
+)
+@click.option(
+    "--description",
+    type=click.STRING,
+    help="Model description with any {variable} in curly braces, sent to the "
+    "model as is.",
+)
+@click.option(
+    "--description-file",
+    type=click.Path(exists=True, dir_okay=False),
+    help="File to read the model description from instead.",
+)
+@click.option(
+    "--inputs",
+    "inputs_file",
+    type=click.Path(exists=True, dir_okay=False),
+    required=True,
+    help="JSON(L), CSV or Parquet file of input instances.",
+)
+@click.option(
+    "--output-file",
+    type=click.Path(dir_okay=False),
+    help="JSONL file to write results to. Defaults to the inputs file name "
+    "with a .validation.jsonl extension.",
+)
+@click.option(
+    "--previous-results",
+    type=click.Path(exists=True, dir_okay=False),
+    help="Results of a previous description to diff against. Defaults to the "
+    "existing output file, if any.",
+)
+@click.option(
+    "--temperature",
+    type=click.FLOAT,
+    default=alignable_model_calls.MEDIUM_TEMP,
+    help="Sampling temperature of the model calls.",
+)
+@click.option(
+    "--max-concurrency",
+    type=click.INT,
+    default=4,
+    help="Maximum number of concurrent model calls.",
+)
+@click.option(
+    "--max-retries",
+    type=click.INT,
+    default=3,
+    help="Maximum number of retries of a failed model call.",
+)
+def validate(
+    *,
+    gemini_key: str | None,
+    model_preset: str | None,
+    max_sequence_length: int,
+    description: str | None,
+    description_file: str | None,
+    inputs_file: str,
+    output_file: str | None,
+    previous_results: str | None,
+    temperature: float,
+    max_concurrency: int,
+    max_retries: int,
+) -> None:
+  if (description is None) == (description_file is None):
+    raise ValueError("Either --description or --description-file is required")
+  if description_file:
+    with open(description_file) as f:
+      description = f.read().strip()
+
+  output_file = output_file or default_validation_output(inputs_file)
+  if previous_results is None and os.path.exists(output_file):
+    previous_results = output_file
+  previous = []
+  if previous_results:
+    previous = validation.read_results(previous_results)
+
+  run_validation(
+      load_prompt_model(gemini_key, model_preset, max_sequence_length),
+      description,
+      read_inputs(inputs_file),
+      output_file,
+      previous,
+      temperature=temperature,
+      max_concurrency=max_concurrency,
+      max_retries=max_retries,
+  )
+
+
 if __name__ == "__main__":
   model_aligner()
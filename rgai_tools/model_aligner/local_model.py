@@ -0,0 +1,130 @@
+from concurrent import futures
+from typing import TYPE_CHECKING
+
+import keras
+from model_alignment import model_helper
+import numpy
+
+from rgai_tools.common import model_loader
+
+if TYPE_CHECKING:
+  import keras_nlp
+
+# Gemma instruction tuned models expect prompts as a user turn.
+_PROMPT_TEMPLATE = "<start_of_turn>user\n{prompt}<end_of_turn>\n<start_of_turn>model\n"
+_END_OF_TURN_TOKEN = "<end_of_turn>"
+
+
+class GemmaModelHelper(model_helper.ModelHelper):
+  """Model helper that runs prompts through a local Gemma model.
+
+  The model stays loaded across calls, and the compiled generation function
+  for each temperature is kept, so only the first call at a new temperature
+  pays for tracing. Calls can be made from any thread, and all run one at a
+  time on a single worker thread owned by the helper, since they share the
+  model.
+
+  The helper sets the model's sampler, so the model should not be used to
+  generate text elsewhere at the same time.
+  """
+
+  def __init__(
+      self,
+      model: "keras_nlp.models.CausalLM",
+      top_k: int = 40,
+  ):
+    self.model = model
+    self.top_k = top_k
+    self._samplers: dict[float, "keras_nlp.samplers.Sampler"] = {}
+    self._generate_functions = {}
+    self._executor = futures.ThreadPoolExecutor(
+        max_workers=1, initializer=model_loader.init_preprocessing_thread
+    )
+
+    tokenizer = model.preprocessor.tokenizer
+    self._stop_token_ids = (tokenizer.end_token_id,)
+    end_of_turn_id = tokenizer.token_to_id(_END_OF_TURN_TOKEN)
+    if tokenizer.id_to_token(end_of_turn_id) == _END_OF_TURN_TOKEN:
+      self._stop_token_ids += (end_of_turn_id,)
+
+  def _generate_function(self, temperature: float):
+    if temperature not in self._samplers:
+      if temperature == 0:
+        sampler = model_loader.get_sampler("greedy")
+      else:
+        vocabulary_size = self.model.backbone.vocabulary_size
+        sampler = model_loader.get_sampler({
+            "class_name": "top_k",
+            "config": {
+                "k": min(self.top_k, vocabulary_size),
+                "temperature": temperature,
+            },
+        })
+      self._samplers[temperature] = sampler
+
+    # The sampler is read when the generation function is traced, so each
+    # sampler gets its own function.
+    if self.model.sampler is not self._samplers[temperature]:
+      self.model.sampler = self._samplers[temperature]
+      self.model.generate_function = self._generate_functions.get(temperature)
+    self._generate_functions[temperature] = self.model.make_generate_function()
+    return self._generate_functions[temperature]
+
+  def _generate(
+      self,
+      prompt: str,
+      temperature: float,
+      candidate_count: int,
+      max_output_tokens: int | None,
+  ) -> list[str | bytes]:
+    preprocessor = self.model.preprocessor
+    prompt = _PROMPT_TEMPLATE.format(prompt=prompt)
+    token_ids = list(preprocessor.tokenizer(prompt))
+    if preprocessor.add_start_token:
+      token_ids = [preprocessor.tokenizer.start_token_id] + token_ids
+
+    max_length = preprocessor.sequence_length
+    if max_output_tokens is not None:
+      max_length = min(max_length, len(token_ids) + max_output_tokens)
+    if len(token_ids) >= max_length:
+      raise ValueError(
+          f"Prompt of {len(token_ids)} tokens leaves no room for a response "
+          f"within the maximum sequence length of {max_length} tokens."
+      )
+
+    prompt_mask = numpy.zeros((candidate_count, max_length), dtype=bool)
+    prompt_mask[:, : len(token_ids)] = True
+    inputs = {
+        "token_ids": numpy.zeros((candidate_count, max_length), dtype="int32"),
+        "padding_mask": prompt_mask,
+    }
+    inputs["token_ids"][:, : len(token_ids)] = token_ids
+
+    generate = self._generate_function(temperature)
+    outputs = generate(inputs, stop_token_ids=self._stop_token_ids)
+
+    # Only decode the response, without the prompt or stop tokens.
+    output_ids = keras.ops.convert_to_numpy(outputs["token_ids"])
+    output_mask = keras.ops.convert_to_numpy(outputs["padding_mask"])
+    output_mask = output_mask & ~prompt_mask
+    output_mask &= ~numpy.isin(output_ids, self._stop_token_ids)
+    texts = preprocessor.generate_postprocess(
+        {"token_ids": output_ids, "padding_mask": output_mask}
+    )
+    return keras.ops.convert_to_numpy(texts).tolist()
+
+  def predict(
+      self,
+      prompt: str,
+      temperature: float,
+      stop_sequences: list[str] | None = None,
+      candidate_count: int = 1,
+      max_output_tokens: int | None = None,
+  ) -> list[str] | str:
+    texts = self._executor.submit(
+        self._generate, prompt, temperature, candidate_count, max_output_tokens
+    ).result()
+    texts = [x.decode("utf-8") if isinstance(x, bytes) else x for x in texts]
+    for stop_sequence in stop_sequences or ():
+      texts = [text.split(stop_sequence, 1)[0] for text in texts]
+    return texts[0] if candidate_count == 1 else texts
@@ -0,0 +1,250 @@
+from concurrent import futures
+import difflib
+import hashlib
+import json
+import threading
+import time
+from typing import Any, Iterable, NamedTuple, Sequence
+
+from absl import logging
+from model_alignment import alignable_model_calls
+from model_alignment import model_helper
+
+
+class ValidationResult(NamedTuple):
+  """The response of the model to one input instance."""
+
+  input: dict[str, Any]
+  response: str | None
+  error: str | None = None
+
+
+class ResponseCache:
+  """Thread-safe cache of model responses by (description, input instance)."""
+
+  def __init__(self):
+    self._responses: dict[bytes, str] = {}
+    self._lock = threading.Lock()
+
+  @staticmethod
+  def key(description: str, input_instance: dict[str, Any]) -> bytes:
+    content = json.dumps([description, input_instance], sort_keys=True)
+    return hashlib.sha1(content.encode("utf-8")).digest()
+
+  def get(self, description: str, input_instance: dict[str, Any]) -> str | None:
+    with self._lock:
+      return self._responses.get(self.key(description, input_instance))
+
+  def put(
+      self,
+      description: str,
+      input_instance: dict[str, Any],
+      response: str,
+  ) -> None:
+    with self._lock:
+      self._responses[self.key(description, input_instance)] = response
+
+
+def _predict_with_retries(
+    model: model_helper.ModelHelper,
+    prompt: str,
+    temperature: float,
+    max_retries: int,
+    retry_delay: float,
+) -> str:
+  for attempt in range(max_retries + 1):
+    try:
+      return model.predict(prompt, temperature=temperature)
+    except Exception as exc:  # pylint: disable=broad-except
+      if attempt == max_retries:
+        raise
+      delay = retry_delay * 2**attempt
+      logging.warning("Model call failed (%s), retrying in %.1fs", exc, delay)
+      time.sleep(delay)
+
+
+def validate(
+    model: model_helper.ModelHelper,
+    description: str,
+    inputs: Sequence[dict[str, Any]],
+    *,
+    temperature: float = alignable_model_calls.MEDIUM_TEMP,
+    max_concurrency: int = 4,
+    max_retries: int = 3,
+    retry_delay: float = 1.0,
+    cache: ResponseCache | None = None,
+) -> list[ValidationResult]:
+  """Runs a model description against every input instance.
+
+  At most `max_concurrency` model calls are in flight at a time, failed calls
+  are retried up to `max_retries` times with exponential backoff, and
+  responses already in `cache` for the same description and input are reused.
+  Inputs that still fail are reported with an error instead of a response.
+
+  Args:
+    model: The model helper used to run the prompts.
+    description: The model description, with `{variable}` placeholders.
+    inputs: The input instances, mapping variable names to values.
+    temperature: The sampling temperature of the model calls.
+    max_concurrency: Maximum number of concurrent model calls.
+    max_retries: Maximum number of retries of a failed model call.
+    retry_delay: Delay before the first retry, in seconds.
+    cache: Optional cache of responses, updated with the new responses.
+
+  Returns:
+    The results, in the same order as `inputs`.
+  """
+  cache = cache if cache is not None else ResponseCache()
+
+  def run(input_instance: dict[str, Any]) -> ValidationResult:
+    response = cache.get(description, input_instance)
+    if response is not None:
+      return ValidationResult(input_instance, response)
+    try:
+      prompt = description.format(**input_instance)
+      response = _predict_with_retries(
+          model, prompt, temperature, max_retries, retry_delay
+      )
+    except Exception as exc:  # pylint: disable=broad-except
+      return ValidationResult(input_instance, None, f"{type(exc).__name__}: {exc}")
+    cache.put(description, input_instance, response)
+    return ValidationResult(input_instance, response)
+
+  with futures.ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+    return list(executor.map(run, inputs))
+
+
+def _input_key(input_instance: dict[str, Any]) -> str:
+  return json.dumps(input_instance, sort_keys=True)
+
+
+def read_results(path: str) -> list[ValidationResult]:
+  """Reads results written by `write_results`."""
+  with open(path) as f:
+    records = [json.loads(line) for line in f if line.strip()]
+  return [
+      ValidationResult(r["input"], r.get("response"), r.get("error"))
+      for r in records
+  ]
+
+
+def write_results(
+    path: str,
+    results: Iterable[ValidationResult],
+    previous_results: Iterable[ValidationResult] = (),
+) -> int:
+  """Writes results as JSONL, marking responses that changed since before.
+
+  Each line holds the input, the response (or error), and the previous
+  response for the same input when there is one.
+
+  Returns:
+    The number of responses which changed from the previous results.
+  """
+  previous = {_input_key(r.input): r.response for r in previous_results}
+  changed_count = 0
+  with open(path, "w") as f:
+    for result in results:
+      record = result._asdict()
+      key = _input_key(result.input)
+      if key in previous:
+        record["previous_response"] = previous[key]
+        record["changed"] = previous[key] != result.response
+        changed_count += record["changed"]
+      f.write(json.dumps(record) + "\n")
+  return changed_count
+
+
+def diff_results(
+    previous_results: Iterable[ValidationResult],
+    results: Iterable[ValidationResult],
+) -> str:
+  """Returns a unified diff of the responses that changed, input by input."""
+  previous = {_input_key(r.input): r.response for r in previous_results}
+  diffs = []
+  for result in results:
+    key = _input_key(result.input)
+    if key not in previous or previous[key] == result.response:
+      continue
+    before = (previous[key] or "").splitlines()
+    after = (result.response or result.error or "").splitlines()
+    diff = difflib.unified_diff(
+        before, after, fromfile="previous", tofile="current", lineterm=""
+    )
+    diffs.append("\n".join([f"Input: {key}", *diff]) + "\n")
+  return "\n".join(diffs)
+
+
+class _FlakyEchoModelHelper(model_helper.ModelHelper):
+  """Stand-in model that echoes prompts, failing the first call for each."""
+
+  def __init__(self, delay: float):
+    self.delay = delay
+    self.calls = 0
+    self.concurrency = 0
+    self.max_concurrency = 0
+    self._failed_prompts = set()
+    self._lock = threading.Lock()
+
+  def predict(
+      self,
+      prompt: str,
+      temperature: float,
+      stop_sequences: list[str] | None = None,
+      candidate_count: int = 1,
+      max_output_tokens: int | None = None,
+  ) -> str:
+    with self._lock:
+      self.calls += 1
+      self.concurrency += 1
+      self.max_concurrency = max(self.max_concurrency, self.concurrency)
+      first_call = prompt not in self._failed_prompts
+      self._failed_prompts.add(prompt)
+    try:
+      time.sleep(self.delay)
+      if first_call:
+        raise RuntimeError("transient failure")
+      return prompt.upper()
+    finally:
+      with self._lock:
+        self.concurrency -= 1
+
+
+def _check_with_stand_in_model() -> None:
+  """Checks retries, concurrency and caching without a real model."""
+  inputs = [{"text": f"input {i}"} for i in range(16)]
+  model = _FlakyEchoModelHelper(delay=0.01)
+  cache = ResponseCache()
+  results = validate(
+      model,
+      "Say {text}",
+      inputs,
+      max_concurrency=4,
+      retry_delay=0.001,
+      cache=cache,
+  )
+  assert [r.response for r in results] == [
+      f"SAY INPUT {i}" for i in range(16)
+  ], results
+  assert model.calls == 2 * len(inputs), model.calls
+  assert model.max_concurrency <= 4, model.max_concurrency
+
+  # Cached responses are reused, and only new inputs reach the model.
+  inputs.append({"text": "new"})
+  results = validate(
+      model, "Say {text}", inputs, retry_delay=0.001, cache=cache
+  )
+  assert results[-1].response == "SAY NEW", results[-1]
+  assert model.calls == 2 * len(inputs), model.calls
+
+  # Calls that still fail after the retries are reported as errors.
+  results = validate(model, "Echo {text}", inputs[:1], max_retries=0)
+  assert results[0].error == "RuntimeError: transient failure", results[0]
+  print(
+      f"Made {model.calls} model calls, at most {model.max_concurrency} at a "
+      "time, and all checks passed."
+  )
+
+
+if __name__ == "__main__":
+  _check_with_stand_in_model()
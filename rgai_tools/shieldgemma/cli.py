@@ -1,8 +1,7 @@
-import sys
-import json5
 import click
 
 from rgai_tools.common import model_loader
+from rgai_tools.common import record_reader
 from rgai_tools.shieldgemma import model_wrapper
 from rgai_tools.shieldgemma import text_processing
 
@@ -20,35 +19,120 @@ def shieldgemma():
     default=_DEFAULT_MODEL_PRESET,
     help="Preset (name) of the model, or path to local keras model.",
 )
-def evaluate(*, model_preset: str):
+@click.option(
+    "--exported-model",
+    type=click.Path(exists=True, file_okay=False),
+    help="Path to a model written by `export`, used instead of the preset.",
+)
+@click.option(
+    "--input-file",
+    type=click.Path(exists=True, dir_okay=False),
+    help="JSON(L), CSV or Parquet file to read from instead of stdin.",
+)
+@click.option(
+    "--num-workers",
+    type=click.INT,
+    default=0,
+    help="Number of worker processes used to parse JSONL input.",
+)
+@click.option(
+    "--warmup/--no-warmup",
+    default=False,
+    help="Compile the scoring function for the largest batch and sequence "
+    "length when loading the model from a preset.",
+)
+def evaluate(
+    *,
+    model_preset: str,
+    exported_model: str | None,
+    input_file: str | None,
+    num_workers: int,
+    warmup: bool,
+):
   # Load model and wrapper.
-  base_model = model_loader.load_gemma_model(model_preset)
-  shieldgemma = model_wrapper.ShieldGemma(base_model)
-  click.echo(f"Loaded ShieldGemma model from preset {model_preset}")
+  if exported_model:
+    shieldgemma = model_wrapper.ShieldGemma(exported_model_path=exported_model)
+    click.echo(f"Loaded exported ShieldGemma model from {exported_model}")
+  else:
+    base_model = model_loader.load_gemma_model(
+        model_preset, stream_weights=True
+    )
+    shieldgemma = model_wrapper.ShieldGemma(base_model, warmup=warmup)
+    click.echo(f"Loaded ShieldGemma model from preset {model_preset}")
+
+  # Read stdin for the user content, or the given input file.
+  click.echo(
+      "Expected format: {'harm_type': 'HATE', 'user_content': 'content'}"
+  )
+  if not input_file:
+    click.echo(
+        "Reading user content from stdin. You can pipe input from another "
+        "command or type it in the terminal followed by [CTRL + D]."
+    )
+  def build_prompt(record: dict[str, str]) -> str:
+    # Parse the HarmType enum from the enum name (not value).
+    record["harm_type"] = text_processing.HarmType[record["harm_type"]]
+    return text_processing.build_prompt(**record)
+
+  # Prompts in input order, with None in place of skipped records so that the
+  # output has one line per input record.
+  entries = []
+
+  def report_error(error: record_reader.RecordError) -> None:
+    click.echo(
+        f"Skipping input line {error.line_number}: {error.content}. "
+        f"Error: {error.error}",
+        err=True,
+    )
+    entries.append(None)
+
+  entries.extend(
+      record_reader.read_records(
+          input_file,
+          required_fields=("harm_type", "user_content"),
+          transform=build_prompt,
+          num_workers=num_workers,
+          on_error=report_error,
+      )
+  )
+
+  # Predict and output the policy violation probability, or null for skipped
+  # records.
+  prompts = [prompt for prompt in entries if prompt is not None]
+  outputs = iter(shieldgemma.predict_score(prompts) if prompts else ())
+  for prompt in entries:
+    click.echo("null" if prompt is None else next(outputs)[0])
 
-  # Read stdin for the user content.
+
+@shieldgemma.command()
+@click.option(
+    "--model-preset",
+    default=_DEFAULT_MODEL_PRESET,
+    help="Preset (name) of the model, or path to local keras model.",
+)
+@click.option(
+    "--max-sequence-length",
+    type=click.INT,
+    default=512,
+    help="Maximum sequence length for the model's preprocessor.",
+)
+@click.option(
+    "--output-dir",
+    type=click.Path(exists=False),
+    required=True,
+    help="Directory to write the exported SavedModel to.",
+)
+def export(*, model_preset: str, max_sequence_length: int, output_dir: str):
+  base_model = model_loader.load_gemma_model(
+      model_preset,
+      max_sequence_length=max_sequence_length,
+      stream_weights=True,
+  )
+  model_wrapper.ShieldGemma(base_model).export(output_dir)
   click.echo(
-      "Expected format: {'harm_type': 'HATE', 'user_content': 'content'}\n"
-      "Reading user content from stdin. You can pipe input from another "
-      "command or type it in the terminal followed by [CTRL + D]."
+      f"Exported ShieldGemma model to {output_dir}. It can be loaded using:\n"
+      f"model_wrapper.ShieldGemma(exported_model_path='{output_dir}')"
   )
-  prompts = []
-  for line in sys.stdin.readlines():
-    line = line.strip()
-    if line:
-      try:
-        record = json5.loads(line)
-        # Parse the HarmType enum from the enum name (not value).
-        record["harm_type"] = text_processing.HarmType[record["harm_type"]]
-        prompts.append(text_processing.build_prompt(**record))
-      except Exception as exc:
-        click.echo(f"Failed to parse input line: {line}. Error: {exc}", err=True)
-        raise exc
-
-  # Predict and output the policy violation probability.
-  outputs = shieldgemma.predict_score(prompts)
-  for output in outputs:
-    click.echo(output[0])
 
 
 if __name__ == "__main__":
@@ -1,19 +1,66 @@
-from typing import Iterable
-import keras_nlp
+from typing import Iterable, TYPE_CHECKING
 
+from rgai_tools.common import export
+from rgai_tools.common import scoring
 from rgai_tools.common import token_probability
 
+if TYPE_CHECKING:
+  import keras_nlp
+
+_TOKEN_SET = ["Yes", "No"]
+
 
 class ShieldGemma:
 
-  def __init__(self, model: keras_nlp.models.CausalLM):
+  def __init__(
+      self,
+      model: "keras_nlp.models.CausalLM | None" = None,
+      jit_compile: bool = True,
+      warmup: bool = False,
+      exported_model_path: str | None = None,
+  ):
+    if (model is None) == (exported_model_path is None):
+      raise ValueError("Either model or exported_model_path must be provided")
+
     self.model = model
+    if exported_model_path:
+      # Exported models bundle the tokenizer and are already compiled.
+      self.probability_model = None
+      self.scoring_fn = export.ExportedScoringModel(exported_model_path)
+      exported_token_set = self.scoring_fn.metadata.get("token_set")
+      if exported_token_set != _TOKEN_SET:
+        raise ValueError(
+            f"Exported token set {exported_token_set} does not match the "
+            f"ShieldGemma token set {_TOKEN_SET}."
+        )
+      return
+
     self.probability_model = token_probability.build_token_probability_model(
         model=model,
-        token_set=["Yes", "No"],
+        token_set=_TOKEN_SET,
     )
+    self.scoring_fn = scoring.ScoringFunction(
+        self.probability_model,
+        max_sequence_length=model.preprocessor.sequence_length,
+        jit_compile=jit_compile,
+    )
+    if warmup:
+      self.scoring_fn.warmup()
 
   def predict_score(self, x_text: Iterable[str]) -> list[tuple[float, float]]:
     """Predicts the probabilities for the "Yes" and "No" tokens."""
+    if self.model is None:
+      return self.scoring_fn(x_text)
     inputs = self.model.preprocessor.generate_preprocess(x_text)
-    return self.probability_model.predict(inputs, verbose=0)
+    return self.scoring_fn(inputs)
+
+  def export(self, path: str) -> None:
+    """Exports the scoring model as a standalone SavedModel."""
+    if self.model is None:
+      raise ValueError("Cannot export a model loaded from an export")
+    export.export_scoring_model(
+        self.model,
+        self.probability_model,
+        path,
+        metadata={"token_set": _TOKEN_SET},
+    )